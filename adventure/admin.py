@@ -14,7 +14,7 @@ class AdventureAdmin(admin.ModelAdmin):
     exclude = ('edx', 'edx_version', 'edx_room_offset', 'edx_artifact_offset', 'edx_effect_offset', 'edx_monster_offset', 'edx_program_file', 'directions', 'first_hint', 'last_hint')
 
     def get_queryset(self, request):
-        return super(AdventureAdmin, self).get_queryset(request).prefetch_related('tags')
+        return super(AdventureAdmin, self).get_queryset(request).prefetch_related('authors', 'tags')
 
     def author_list(self, obj):
         return ", ".join(o.name for o in obj.authors.all())
@@ -0,0 +1,26 @@
+def query_budget(default, **actions):
+    """
+    Class decorator that declares the maximum number of database queries a viewset may run to handle one request.
+
+    The budget applies to every action, unless the action has its own budget, e.g.:
+
+        @query_budget(3, bundle=10)
+        class AdventureViewSet(viewsets.ReadOnlyModelViewSet):
+
+    The budgets are enforced by the query budget tests in adventure/tests.py, which call every API route against a
+    real adventure.
+    """
+    def decorator(cls):
+        cls.query_budget = dict(actions, default=default)
+        return cls
+    return decorator
+
+
+def get_query_budget(viewset, action):
+    """
+    Gets the query budget of a viewset action, or None if the viewset doesn't declare one.
+    """
+    budget = getattr(viewset, 'query_budget', None)
+    if budget is None:
+        return None
+    return budget.get(action, budget['default'])
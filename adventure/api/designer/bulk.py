@@ -0,0 +1,205 @@
+"""
+Bulk editing for the designer API.
+
+Pasting or editing many rooms, artifacts, etc. one request at a time means a round trip and a transaction for every
+object. BulkEditMixin adds a "bulk" action to a designer viewset that takes all the changes at once:
+
+    POST /api/designer/adventures/<slug>/rooms/bulk
+    {
+        "create": [{"id": 30, "name": "...", ...}, ...],
+        "update": [{"id": 2, "description": "..."}, ...],
+        "delete": [5, 6]
+    }
+
+Objects are identified by their in-game ID ("id"), like in the rest of the API. New objects without an ID get the
+next unused one. Updates can include the "version" the client last saw, to make sure nobody else has changed the
+object since (see ConcurrencyMixin). The whole batch is validated with the model's own validation first. If anything is wrong, nothing is
+saved, and the response has the errors for each item, in the same positions as the request (an empty object for the
+items that were OK). Otherwise, the changes are written with one bulk query per operation, in a single transaction.
+"""
+from django.core.exceptions import ValidationError as ModelValidationError
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from adventure.models import Adventure, batch_content_changes
+
+OPERATIONS = ('create', 'update', 'delete')
+
+# the model permission needed for each operation
+PERMISSIONS = {'create': 'add', 'update': 'change', 'delete': 'delete'}
+
+
+class BulkEditMixin:
+    """
+    Adds the "bulk" action to a designer viewset. See the module docstring.
+    """
+    # The model field with the in-game ID, which the API calls "id". None if "id" is the primary key, which the
+    # database assigns to new objects.
+    bulk_id_field = None
+    # fields that prepare_bulk_item() handles, besides the serializer's writable fields
+    bulk_extra_fields = ()
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, adventure_id=None):
+        operations = self.get_bulk_operations(request.data)
+        model = self.get_queryset().model
+        for operation in operations:
+            perm = '{}.{}_{}'.format(model._meta.app_label, PERMISSIONS[operation], model._meta.model_name)
+            if not request.user.has_perm(perm):
+                self.permission_denied(request)
+
+        adventure = get_object_or_404(Adventure.objects.only('id'), slug=adventure_id)
+        # The objects are locked until the changes are saved, so nobody else can change them after their versions
+        # are checked.
+        with transaction.atomic():
+            return self.bulk_edit(model, operations, adventure.id)
+
+    def bulk_edit(self, model, operations, adventure_id):
+        """
+        Validates and saves the operations of a bulk request. Must run in a transaction.
+        """
+        id_field = self.bulk_id_field or 'pk'
+        writable = self.get_bulk_fields()
+        queryset = model.objects.filter(adventure_id=adventure_id)
+        ids = [item.get('id') for item in operations.get('update', [])] + operations.get('delete', [])
+        ids = [object_id for object_id in ids if isinstance(object_id, int)]
+        existing = {getattr(obj, id_field): obj
+                    for obj in queryset.select_for_update().filter(**{id_field + '__in': ids})}
+        taken = set()
+        if self.bulk_id_field and 'create' in operations:
+            taken = set(queryset.values_list(self.bulk_id_field, flat=True))
+
+        errors = {operation: [{} for item in items] for operation, items in operations.items()}
+        deleted = []
+        for i, object_id in enumerate(operations.get('delete', [])):
+            if object_id not in existing:
+                errors['delete'][i] = {'id': ['Not found.']}
+            elif object_id in deleted:
+                errors['delete'][i] = {'id': ['Deleted more than once.']}
+            else:
+                deleted.append(object_id)
+
+        updated = []
+        update_fields = set()
+        for i, item in enumerate(operations.get('update', [])):
+            object_id = item.get('id')
+            instance = existing.get(object_id) if isinstance(object_id, int) else None
+            if instance is None:
+                errors['update'][i] = {'id': ['Not found.']}
+            elif object_id in deleted or instance in updated:
+                errors['update'][i] = {'id': ['Changed more than once.']}
+            elif item.get('version', instance.version) != instance.version:
+                errors['update'][i] = {'version': ['Somebody else has changed this since you loaded it.']}
+            else:
+                errors['update'][i] = self.apply_bulk_item(instance, item, writable)
+                updated.append(instance)
+                update_fields.update(writable[name] for name in item if name in writable)
+                update_fields.update(name for name in item if name in self.bulk_extra_fields)
+
+        created = []
+        taken -= set(deleted)
+        for i, item in enumerate(operations.get('create', [])):
+            instance = model(adventure_id=adventure_id)
+            item_errors = self.apply_bulk_item(instance, item, writable)
+            if self.bulk_id_field:
+                object_id = item.get('id')
+                if object_id is None:
+                    # the deleted IDs aren't reused, in case something else still refers to them
+                    object_id = max(taken | set(deleted) | {0}) + 1
+                elif not isinstance(object_id, int) or object_id in taken:
+                    item_errors.setdefault('id', []).append('Must be a number that is not already used.')
+                setattr(instance, self.bulk_id_field, object_id)
+                taken.add(object_id)
+            elif 'id' in item:
+                item_errors.setdefault('id', []).append('Assigned by the server.')
+            errors['create'][i] = item_errors
+            created.append(instance)
+
+        if any(e for items in errors.values() for e in items):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with batch_content_changes():
+            if deleted:
+                queryset.filter(pk__in=[existing[object_id].pk for object_id in deleted]).delete()
+            if updated and update_fields:
+                model.objects.bulk_update(updated, update_fields)
+            if created:
+                created = model.objects.bulk_create(created)
+
+        # Only some databases return the primary keys of the created objects, so they can be None
+        return Response({
+            'created': [getattr(obj, id_field) for obj in created],
+            'updated': [getattr(obj, id_field) for obj in updated],
+            'deleted': deleted,
+        })
+
+    @staticmethod
+    def get_bulk_operations(data):
+        """
+        Checks the shape of the request body, and returns the operations in it
+        """
+        if not isinstance(data, dict) or not set(data) <= set(OPERATIONS):
+            raise ValidationError({'non_field_errors': [
+                'Expected an object with "create", "update" and/or "delete".']})
+        operations = {}
+        for operation in OPERATIONS:
+            items = data.get(operation)
+            if items is None:
+                continue
+            item_type = int if operation == 'delete' else dict
+            if not isinstance(items, list) or not all(isinstance(item, item_type) for item in items):
+                raise ValidationError({operation: ['Expected a list of {}.'.format(
+                    'IDs' if operation == 'delete' else 'objects')]})
+            operations[operation] = items
+        return operations
+
+    def get_bulk_fields(self):
+        """
+        Gets the fields that can be set in bulk, from the writable fields of the viewset's serializer.
+
+        :return: A dict of API field name => model field name
+        """
+        model = self.get_queryset().model
+        model_fields = {f.name for f in model._meta.concrete_fields} - {'id', 'adventure', self.bulk_id_field}
+        return {name: field.source for name, field in self.get_serializer().fields.items()
+                if not field.read_only and field.source in model_fields}
+
+    def apply_bulk_item(self, instance, item, writable):
+        """
+        Sets the fields of a new or existing object from an item in the request, and validates it.
+
+        :return: The errors, as a dict of field name => list of messages
+        """
+        errors = {}
+        unknown = set(item) - set(writable) - set(self.bulk_extra_fields) - {'id', 'version'}
+        if unknown:
+            errors['non_field_errors'] = ['Unknown fields: {}'.format(', '.join(sorted(unknown)))]
+        for name, value in item.items():
+            if name in writable:
+                field = instance._meta.get_field(writable[name])
+                # the designer sends an empty string for a blank number
+                if value == '' and field.null:
+                    value = None
+                setattr(instance, field.attname, value)
+        errors.update(self.prepare_bulk_item(instance, item))
+        exclude = [f.name for f in instance._meta.fields if f.name not in writable.values()]
+        try:
+            instance.full_clean(exclude=exclude, validate_unique=False)
+        except ModelValidationError as e:
+            for name, messages in e.message_dict.items():
+                if name == '__all__':
+                    name = 'non_field_errors'
+                errors.setdefault(name, []).extend(messages)
+        return errors
+
+    def prepare_bulk_item(self, instance, item):
+        """
+        Hook for setting fields that aren't in the serializer's writable fields, e.g., relations.
+
+        :return: The errors, as a dict of field name => list of messages
+        """
+        return {}
@@ -34,7 +34,7 @@ class RoomExitSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RoomExit
-        fields = ('id', 'direction', 'room_from', 'room_to', 'door_id', 'effect_id')
+        fields = ('id', 'direction', 'room_from', 'room_to', 'door_id', 'effect_id', 'version')
 
 
 class RoomSerializer(serializers.ModelSerializer):
@@ -45,7 +45,7 @@ class RoomSerializer(serializers.ModelSerializer):
         model = Room
         fields = ('id', 'name', 'description', 'is_markdown', 'is_dark',
                   'dark_name', 'dark_description', 'effect', 'effect_inline',
-                  'data', 'exits')
+                  'data', 'exits', 'version')
 
 
 class ArtifactSerializer(serializers.ModelSerializer):
@@ -1,108 +1,323 @@
-from rest_framework import viewsets
-from django.db.models import Q
+from datetime import timedelta
 
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Max, Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from adventure.api.budget import query_budget
+from adventure.api.designer.bulk import BulkEditMixin
+from adventure.api.mixins import ConcurrencyMixin, ContentCacheMixin, SparseFieldsetMixin
+from adventure.api.renderers import CONTENT_RENDERERS
 from . import serializers
-from adventure.models import Adventure, Author, Room, Artifact, Effect, Monster, Hint, RoomExit
+from adventure.models import Adventure, Author, Room, Artifact, Effect, Monster, Hint, RoomExit, ContentChange, \
+    batch_content_changes
+from adventure.integrity import check_adventure
+from adventure.name_index import build_name_index
 
 
+@query_budget(1)
 class AuthorViewSet(viewsets.ReadOnlyModelViewSet):
     """
     For listing or retrieving authors.
     """
     queryset = Author.objects.filter()
     serializer_class = serializers.AuthorSerializer
+    renderer_classes = CONTENT_RENDERERS
 
     def get_queryset(self):
         queryset = self.queryset
         return queryset
 
 
-class AdventureViewSet(viewsets.ModelViewSet):
+@query_budget(3, changes=8, integrity=6)
+class AdventureViewSet(SparseFieldsetMixin, ContentCacheMixin, viewsets.ModelViewSet):
     """
     For listing or retrieving adventure data.
     """
     queryset = Adventure.objects.all()
     serializer_class = serializers.AdventureSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'slug'
+    # The change log is written in the same transaction as the changes, so a transaction that commits late can add
+    # rows with lower IDs than the ones already sent. The change feed leaves out the newest rows until they settle.
+    change_settle_time = timedelta(seconds=2)
+    # the most change log rows read per request
+    change_page_size = 500
 
     def get_queryset(self):
-        queryset = Adventure.objects.all()
+        queryset = Adventure.objects.all().with_stats()
         return queryset
 
+    @action(detail=True, url_path='name-index')
+    def name_index(self, request, slug=None):
+        """
+        The names players can use for the artifacts and monsters, including the ones that refer to more than one
+        object. See adventure/name_index.py.
+        """
+        version = Adventure.objects.filter(slug=slug).values_list('id', 'content_updated_at').first()
+        if version is None:
+            raise NotFound()
+        adventure_id, content_updated_at = version
+        return self.cached_response(request, adventure_id, content_updated_at, 'name-index',
+                                    lambda: build_name_index(adventure_id))
+
+    @action(detail=True)
+    def integrity(self, request, slug=None):
+        """
+        The broken links between the rooms, exits, artifacts, effects and monsters, e.g., an exit to a room that
+        doesn't exist. See adventure/integrity.py.
+        """
+        version = Adventure.objects.filter(slug=slug).values_list('id', 'content_updated_at').first()
+        if version is None:
+            raise NotFound()
+        adventure_id, content_updated_at = version
+        return self.cached_response(request, adventure_id, content_updated_at, 'integrity',
+                                    lambda: {'findings': check_adventure(adventure_id)})
+
+    @action(detail=True)
+    def changes(self, request, slug=None):
+        """
+        The rooms, exits, artifacts, effects and monsters changed since the client last looked, so the designer can
+        update what it has loaded instead of loading everything again.
+
+        Without ?since, the response just has the current cursor. With ?since=<cursor>, it has:
+            "cursor": The cursor for the next request
+            "more": True if there were too many changes for one response. Ask again with the new cursor.
+            "updated": The current data of the objects created or changed, by type (e.g., "rooms"), in the same
+              format as the other designer API actions
+            "deleted": The IDs of the objects deleted, by type
+            "reload": The types to load again in full, because an object changed without the log knowing which
+        """
+        adventure_id = Adventure.objects.filter(slug=slug).values_list('id', flat=True).first()
+        if adventure_id is None:
+            raise NotFound()
+        log = ContentChange.objects.filter(adventure_id=adventure_id,
+                                           changed_at__lte=timezone.now() - self.change_settle_time)
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'cursor': log.aggregate(cursor=Max('id'))['cursor'] or 0})
+        if not since.isdigit():
+            raise ValidationError({'since': ['Must be a cursor from an earlier response.']})
+
+        rows = list(log.filter(id__gt=int(since)).order_by('id')
+                    .values_list('id', 'type', 'object_id')[:self.change_page_size + 1])
+        more = len(rows) > self.change_page_size
+        rows = rows[:self.change_page_size]
+        touched = {}
+        reload = set()
+        for row_id, change_type, object_id in rows:
+            if object_id is None:
+                reload.add(change_type)
+            else:
+                touched.setdefault(change_type, set()).add(object_id)
 
-class RoomViewSet(viewsets.ModelViewSet):
+        updated = {}
+        deleted = {}
+        for change_type, object_ids in touched.items():
+            if change_type in reload or change_type not in CHANGE_FEED_VIEWSETS:
+                continue
+            viewset = CHANGE_FEED_VIEWSETS[change_type]
+            id_field = viewset.queryset.model.change_id_field
+            objects = list(viewset.queryset.filter(adventure_id=adventure_id, **{id_field + '__in': object_ids}))
+            updated[change_type] = viewset.serializer_class(objects, many=True, context={'request': request}).data
+            deleted[change_type] = sorted(object_ids - {getattr(obj, id_field) for obj in objects})
+
+        return Response({
+            'cursor': rows[-1][0] if rows else int(since),
+            'more': more,
+            'updated': updated,
+            'deleted': {change_type: ids for change_type, ids in deleted.items() if ids},
+            'reload': sorted(reload),
+        })
+
+
+@query_budget(2, bulk=14)
+class RoomViewSet(SparseFieldsetMixin, ConcurrencyMixin, BulkEditMixin, viewsets.ModelViewSet):
     """
     Lists room data for an adventure.
     """
-    queryset = Room.objects.all()
+    queryset = Room.objects.prefetch_related('exits')
     serializer_class = serializers.RoomSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'room_id'
+    bulk_id_field = 'room_id'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class RoomExitViewSet(viewsets.ModelViewSet):
+@query_budget(1, bulk=13, replace=10)
+class RoomExitViewSet(SparseFieldsetMixin, ConcurrencyMixin, BulkEditMixin, viewsets.ModelViewSet):
     """
     Room exit data for an adventure.
     """
-    queryset = RoomExit.objects.all()
+    queryset = RoomExit.objects.select_related('room_from')
     serializer_class = serializers.RoomExitSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'id'
+    bulk_extra_fields = ('room_from', )
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
+    def get_room_ids(self):
+        """
+        Maps the in-game room IDs of the adventure to the primary keys of the rooms
+        """
+        if not hasattr(self, '_room_ids'):
+            self._room_ids = dict(Room.objects.filter(adventure__slug=self.kwargs['adventure_id'])
+                                  .values_list('room_id', 'pk'))
+        return self._room_ids
+
+    def prepare_bulk_item(self, instance, item):
+        """
+        Sets the room an exit is in, from the room's in-game ID
+        """
+        if 'room_from' not in item:
+            return {} if instance.room_from_id else {'room_from': ['This field is required.']}
+        room_ids = self.get_room_ids()
+        if item['room_from'] not in room_ids:
+            return {'room_from': ['Room not found.']}
+        instance.room_from_id = room_ids[item['room_from']]
+        return {}
 
-class ArtifactViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['put'])
+    def replace(self, request, adventure_id=None):
+        """
+        Replaces all the exits of the adventure, or of one room with ?room=<room ID>, with the exits in the request.
+
+        The request has a list of exits, with the same fields as the other actions. The exits are matched to the
+        existing ones by room and direction, and only the differences are written, with one query each for the new,
+        changed and deleted exits. Fields left out of an exit get their default values, as for a new exit. Like the
+        bulk action, nothing is saved if any exit has errors.
+        """
+        items = request.data
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValidationError({'non_field_errors': ['Expected a list of exits.']})
+        for perm in ('add', 'change', 'delete'):
+            if not request.user.has_perm('adventure.{}_roomexit'.format(perm)):
+                self.permission_denied(request)
+
+        adventure = get_object_or_404(Adventure.objects.only('id'), slug=adventure_id)
+        existing = RoomExit.objects.filter(adventure_id=adventure.id)
+        room = request.query_params.get('room')
+        if room is not None:
+            if not room.lstrip('-').isdigit() or int(room) not in self.get_room_ids():
+                raise NotFound('Room {} not found.'.format(room))
+            existing = existing.filter(room_from_id=self.get_room_ids()[int(room)])
+            items = [dict({'room_from': int(room)}, **item) for item in items]
+        existing = {(e.room_from_id, e.direction): e for e in existing}
+
+        writable = self.get_bulk_fields()
+        errors = []
+        seen = set()
+        created = []
+        updated = []
+        update_fields = set()
+        for item in items:
+            instance = RoomExit(adventure_id=adventure.id)
+            item_errors = self.apply_bulk_item(instance, item, writable)
+            key = (instance.room_from_id, instance.direction)
+            if room is not None and item['room_from'] != int(room):
+                item_errors.setdefault('room_from', []).append('Must be room {}.'.format(room))
+            elif key in seen:
+                item_errors.setdefault('direction', []).append('The room already has an exit in this direction.')
+            seen.add(key)
+            errors.append(item_errors)
+            old = existing.get(key)
+            if old is None:
+                created.append(instance)
+                continue
+            changed = [name for name in writable.values() if getattr(old, name) != getattr(instance, name)]
+            for name in changed:
+                setattr(old, name, getattr(instance, name))
+            if changed:
+                updated.append(old)
+                update_fields.update(changed)
+
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        deleted = [e.pk for key, e in existing.items() if key not in seen]
+        with transaction.atomic(), batch_content_changes():
+            if deleted:
+                RoomExit.objects.filter(pk__in=deleted).delete()
+            if updated:
+                RoomExit.objects.bulk_update(updated, update_fields)
+            if created:
+                RoomExit.objects.bulk_create(created)
+        return Response({'created': len(created), 'updated': len(updated), 'deleted': len(deleted)})
+
+
+@query_budget(1, bulk=13)
+class ArtifactViewSet(SparseFieldsetMixin, ConcurrencyMixin, BulkEditMixin, viewsets.ModelViewSet):
     """
     Lists artifact data for an adventure.
     """
     queryset = Artifact.objects.order_by('artifact_id')
     serializer_class = serializers.ArtifactSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'artifact_id'
+    bulk_id_field = 'artifact_id'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class EffectViewSet(viewsets.ModelViewSet):
+@query_budget(1, bulk=13)
+class EffectViewSet(SparseFieldsetMixin, ConcurrencyMixin, BulkEditMixin, viewsets.ModelViewSet):
     """
     Lists effect data for an adventure.
     """
     queryset = Effect.objects.all()
     serializer_class = serializers.EffectSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'effect_id'
+    bulk_id_field = 'effect_id'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class MonsterViewSet(viewsets.ModelViewSet):
+@query_budget(1, bulk=13)
+class MonsterViewSet(SparseFieldsetMixin, ConcurrencyMixin, BulkEditMixin, viewsets.ModelViewSet):
     """
     Lists monster data for an adventure.
     """
     queryset = Monster.objects.all().order_by('monster_id')
     serializer_class = serializers.MonsterSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'monster_id'
+    bulk_id_field = 'monster_id'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class HintViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(2)
+class HintViewSet(SparseFieldsetMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists hints for an adventure.
     """
-    queryset = Hint.objects.all()
+    queryset = Hint.objects.prefetch_related('answers')
     serializer_class = serializers.HintSerializer
+    renderer_classes = CONTENT_RENDERERS
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(Q(adventure__slug=adventure_id) | Q(question="EAMON GENERAL HELP.", edx="E001")).order_by('index')
 
+
+# the designer viewsets for the types in the change feed. See AdventureViewSet.changes().
+CHANGE_FEED_VIEWSETS = {viewset.queryset.model.change_type: viewset for viewset in (
+    RoomViewSet, RoomExitViewSet, ArtifactViewSet, EffectViewSet, MonsterViewSet)}
@@ -0,0 +1,167 @@
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from adventure.api.game import serializers
+from adventure.api.game.fast_serializers import FastSerializer
+from adventure.models import Room, RoomExit, Artifact, Effect, Monster, Hint
+from adventure.world_index import index_game_data
+
+
+def general_help_filter():
+    """
+    The "EAMON GENERAL HELP." hint is shown in every adventure, in addition to the adventure's own hints.
+    """
+    return Q(question="EAMON GENERAL HELP.", edx="E001")
+
+
+# Process-wide copy of the general help hint, which is the same for every adventure. See get_general_help().
+_general_help = {'loaded_at': None, 'hints': []}
+
+# Allows for a change to the general help that was still being committed when the copy was loaded
+GENERAL_HELP_MARGIN = timedelta(minutes=1)
+
+
+def get_general_help(content_updated_at):
+    """
+    Gets the general help hint(s), with their answers prefetched.
+
+    The hints are kept in memory for the life of the process. Changing the general help updates the
+    content_updated_at of every adventure (see adventure/signals.py), so the copy is current as long as it was loaded
+    after the content_updated_at of the adventure being served.
+
+    :param content_updated_at: The content_updated_at of the adventure being served
+    """
+    loaded_at = _general_help['loaded_at']
+    if loaded_at is None or content_updated_at > loaded_at:
+        loaded_at = timezone.now() - GENERAL_HELP_MARGIN
+        hints = list(Hint.objects.filter(general_help_filter()).prefetch_related('answers'))
+        _general_help.update(loaded_at=loaded_at, hints=hints)
+    return _general_help['hints']
+
+
+def get_hints(queryset, content_updated_at):
+    """
+    Adds the general help to an adventure's own hints, in the order of their index.
+
+    :param queryset: The adventure's hints
+    :param content_updated_at: The content_updated_at of the adventure
+    """
+    hints = list(queryset.exclude(general_help_filter())) + get_general_help(content_updated_at)
+    return sorted(hints, key=lambda h: hint_order(h.index))
+
+
+def serialize_hints(serializer, queryset, content_updated_at):
+    """
+    Serializes an adventure's own hints with FastSerializer, and adds the general help, in the order of their index.
+
+    :param serializer: A HintSerializer, with many=True
+    :param queryset: The adventure's hints
+    :param content_updated_at: The content_updated_at of the adventure
+    """
+    hints = [(row['index'], data) for row, data in FastSerializer(serializer).serialize_rows(
+        queryset.exclude(general_help_filter()), extra_columns=['index'])]
+    hints += [(h.index, serializer.child.to_representation(h)) for h in get_general_help(content_updated_at)]
+    return [data for index, data in sorted(hints, key=lambda h: hint_order(h[0]))]
+
+
+def hint_order(index):
+    """
+    Sorts hints the same way as the database (nulls first)
+    """
+    return index is not None, index or 0
+
+
+def build_bundle(adventure, html=False):
+    """
+    Builds the complete game data for an adventure, in the same format as the individual game API endpoints.
+
+    Uses one query per table, so the client can load the whole adventure in a single request. Also includes the
+    initial-world indexes (see adventure/world_index.py), so the client doesn't have to build them.
+
+    :param html: Whether to include the rendered HTML of the Markdown fields
+    """
+    context = {'html': html}
+    rooms = Room.objects.filter(adventure_id=adventure.id)
+    artifacts = Artifact.objects.filter(adventure_id=adventure.id).order_by('artifact_id')
+    effects = Effect.objects.filter(adventure_id=adventure.id)
+    monsters = Monster.objects.filter(adventure_id=adventure.id).order_by('monster_id')
+    hints = Hint.objects.filter(adventure_id=adventure.id).order_by('index')
+    data = {
+        'adventure': serializers.AdventureSerializer(adventure, context=context).data,
+        'rooms': FastSerializer(serializers.RoomSerializer(context=context)).serialize(rooms),
+        'artifacts': FastSerializer(serializers.ArtifactSerializer(context=context)).serialize(artifacts),
+        'effects': FastSerializer(serializers.EffectSerializer(context=context)).serialize(effects),
+        'monsters': FastSerializer(serializers.MonsterSerializer(context=context)).serialize(monsters),
+        'hints': serialize_hints(serializers.HintSerializer(many=True, context=context), hints,
+                                 adventure.content_updated_at),
+    }
+    data['indexes'] = index_game_data(data['rooms'], data['artifacts'], data['monsters'])
+    return data
+
+
+def find_neighborhood(adventure_id, room_id, depth):
+    """
+    Finds the rooms that can be reached from a room in at most `depth` moves, by following the room exits.
+
+    :return: A dict of room ID => distance from the starting room
+    """
+    exits = {}
+    for room_from, room_to in RoomExit.objects.filter(room_from__adventure_id=adventure_id)\
+            .values_list('room_from__room_id', 'room_to'):
+        exits.setdefault(room_from, set()).add(room_to)
+
+    distances = {room_id: 0}
+    frontier = [room_id]
+    for distance in range(1, depth + 1):
+        # room_to is zero for no exit, and negative for special exits (e.g., the exit from the adventure)
+        frontier = [r for room in frontier for r in exits.get(room, ()) if r > 0 and r not in distances]
+        for r in frontier:
+            distances[r] = distance
+    return distances
+
+
+def build_neighborhood(adventure_id, room_id, depth, html=False):
+    """
+    Builds the game data for the part of an adventure near a room: the rooms within `depth` moves of it, and the
+    monsters and artifacts in those rooms. Artifacts inside containers or carried by monsters are included too.
+
+    This lets the client load a large adventure a piece at a time as the player moves, instead of all at once.
+
+    :param html: Whether to include the rendered HTML of the Markdown fields
+    :return: The data, or None if the room doesn't exist
+    """
+    context = {'html': html}
+    distances = find_neighborhood(adventure_id, room_id, depth)
+    rooms = list(Room.objects.filter(adventure_id=adventure_id, room_id__in=distances).prefetch_related('exits'))
+    if room_id not in {r.room_id for r in rooms}:
+        return None
+    monsters = list(Monster.objects.filter(adventure_id=adventure_id, room_id__in=distances).order_by('monster_id'))
+
+    # Resolve the artifact locations in memory, because containers can be nested inside other containers
+    monster_ids = {m.monster_id for m in monsters}
+    locations = Artifact.objects.filter(adventure_id=adventure_id)\
+        .values_list('artifact_id', 'room_id', 'monster_id', 'container_id')
+    contents = {}
+    artifact_ids = set()
+    for artifact_id, in_room, carried_by, container_id in locations:
+        if in_room in distances or carried_by in monster_ids:
+            artifact_ids.add(artifact_id)
+        elif container_id is not None:
+            contents.setdefault(container_id, []).append(artifact_id)
+    containers = list(artifact_ids)
+    while containers:
+        containers = [a for c in containers for a in contents.pop(c, ()) if a not in artifact_ids]
+        artifact_ids.update(containers)
+    artifacts = Artifact.objects.filter(adventure_id=adventure_id, artifact_id__in=artifact_ids)\
+        .order_by('artifact_id')
+
+    return {
+        'room_id': room_id,
+        'depth': depth,
+        'distances': distances,
+        'rooms': serializers.RoomSerializer(rooms, many=True, context=context).data,
+        'artifacts': serializers.ArtifactSerializer(artifacts, many=True, context=context).data,
+        'monsters': serializers.MonsterSerializer(monsters, many=True, context=context).data,
+    }
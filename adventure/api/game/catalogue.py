@@ -0,0 +1,100 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from adventure.api.game import serializers
+from adventure.models import Adventure
+
+# Process-wide index of the active adventures. See get_index().
+_index = {'version': None, 'built_at': None, 'entries': []}
+
+# How long to keep the index when nothing has changed, so the play counts and ratings don't get too old
+INDEX_MAX_AGE = timedelta(minutes=10)
+
+
+def get_version():
+    """
+    Gets a value that changes whenever an adventure, or its tags or authors, changes.
+
+    Saving an adventure and changing its tags or authors all update its content_updated_at (see adventure/signals.py)
+    and the count catches deleted adventures.
+    """
+    version = Adventure.objects.aggregate(updated=Max('content_updated_at'), count=Count('id'))
+    return version['updated'], version['count']
+
+
+def build_index():
+    """
+    Builds the catalogue entries for all the active adventures, with the serialized data and the values to filter on.
+    """
+    adventures = Adventure.objects.filter(active=True).with_stats()
+    entries = []
+    for adventure in adventures:
+        data = serializers.AdventureCatalogueSerializer(adventure).data
+        authors = list(adventure.authors.all())
+        entries.append({
+            'data': data,
+            'tags': set(data['tags']),
+            'authors': {a.id: a.name for a in authors},
+            'featured_month': adventure.featured_month,
+            'text': ' '.join([adventure.name, adventure.description or ''] + [a.name for a in authors]
+                             + data['tags']).lower(),
+        })
+    return entries
+
+
+def get_index():
+    """
+    Gets the catalogue index, rebuilding it if the adventures changed or it's too old.
+    """
+    version = get_version()
+    now = timezone.now()
+    if _index['version'] != version or now - _index['built_at'] > INDEX_MAX_AGE:
+        _index.update(version=version, built_at=now, entries=build_index())
+    return _index['entries']
+
+
+def search(tags=(), authors=(), featured_month=None, text=None):
+    """
+    Finds the adventures in the catalogue that match all the filters, and counts the tags, authors, and featured
+    months of the matching adventures.
+
+    :param tags: Tag names. Matches adventures with all of these tags.
+    :param authors: Author IDs. Matches adventures by all of these authors.
+    :param featured_month: A month, in YYYY-MM format
+    :param text: Words to search for in the name, description, authors, and tags
+    :return: A dict with the count, the results, and the facet counts
+    """
+    tags = set(tags)
+    authors = set(authors)
+    words = text.lower().split() if text else []
+    results = [
+        entry for entry in get_index()
+        if tags <= entry['tags']
+        and authors <= entry['authors'].keys()
+        and (featured_month is None or entry['featured_month'] == featured_month)
+        and all(word in entry['text'] for word in words)
+    ]
+
+    tag_counts = Counter(tag for entry in results for tag in entry['tags'])
+    author_counts = Counter(author for entry in results for author in entry['authors'].items())
+    month_counts = Counter(entry['featured_month'] for entry in results if entry['featured_month'])
+    return {
+        'count': len(results),
+        'results': [entry['data'] for entry in results],
+        'facets': {
+            'tags': [{'tag': tag, 'count': count} for tag, count in sort_counts(tag_counts)],
+            'authors': [{'id': author_id, 'name': name, 'count': count}
+                        for (author_id, name), count in sort_counts(author_counts, key=lambda a: a[1])],
+            'featured_months': [{'month': month, 'count': count} for month, count in sort_counts(month_counts)],
+        },
+    }
+
+
+def sort_counts(counter, key=lambda value: value):
+    """
+    Sorts facet counts with the most common first, then by value
+    """
+    return sorted(counter.items(), key=lambda item: (-item[1], key(item[0])))
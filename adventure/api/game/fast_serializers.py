@@ -0,0 +1,149 @@
+"""
+A faster way to serialize lists of adventure content for the game API.
+
+Going through a DRF ModelSerializer means creating a model instance for each row, then calling get_attribute() and
+to_representation() on every field. FastSerializer reads values() rows instead, and converts them with a field map
+that's built once from the serializer. The output is the same as the serializer's.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields as drf_fields
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import ListSerializer, ModelSerializer
+
+from adventure.api.game.serializers import MarkdownHTMLMixin, html_requested
+from adventure.rendering import render_markdown
+
+# Fields whose to_representation() doesn't change the values that come from the database
+PLAIN_FIELDS = (drf_fields.IntegerField, drf_fields.CharField, drf_fields.BooleanField)
+
+# Field maps, by serializer class and field names. See FastSerializer.compile().
+_compiled = {}
+
+
+class UnsupportedSerializer(Exception):
+    """
+    Raised for a serializer that FastSerializer can't reproduce exactly, e.g., one with a method field
+    """
+
+
+class FastSerializer:
+    """
+    Serializes a queryset the same way as a ModelSerializer, from values() rows.
+
+    Supports the field types used by the game serializers: plain model fields, choice fields, primary key
+    relations, and nested lists of related objects (e.g., room exits). Fields that the serializer would skip because
+    the model doesn't have them (e.g., the hint "id") are skipped here too.
+    """
+
+    def __init__(self, serializer):
+        """
+        :param serializer: An instance of the serializer to copy, with any fields that aren't wanted already removed
+        """
+        if isinstance(serializer, ListSerializer):
+            serializer = serializer.child
+        self.serializer = serializer
+        self.model = serializer.Meta.model
+        self.fields, self.columns, self.nested = self.compile(serializer)
+        # the Markdown fields to render, if the client asked for HTML
+        self.markdown = None
+        if isinstance(serializer, MarkdownHTMLMixin) and html_requested(serializer.context):
+            self.markdown = (serializer.markdown_fields, serializer.markdown_flag)
+            if serializer.markdown_flag:
+                self.columns.add(serializer.markdown_flag)
+
+    @classmethod
+    def compile(cls, serializer):
+        """
+        Builds the field map for a serializer: a list of (field name, column, conversion function or None), the
+        columns to read, and the nested lists as (field name, column in the related table).
+        """
+        key = (type(serializer), tuple(serializer.fields))
+        if key not in _compiled:
+            model = serializer.Meta.model
+            fields = []
+            nested = []
+            for name, field in serializer.fields.items():
+                if isinstance(field, ListSerializer) and isinstance(field.child, ModelSerializer):
+                    relation = model._meta.get_field(field.source)
+                    nested.append((name, relation.field.attname))
+                    # filled in by serialize(). This keeps the fields in the same order as the serializer.
+                    fields.append((name, None, None))
+                    continue
+                if len(field.source_attrs) != 1:
+                    raise UnsupportedSerializer('{}.{} has source "{}"'.format(
+                        type(serializer).__name__, name, field.source))
+                try:
+                    model_field = model._meta.get_field(field.source)
+                except FieldDoesNotExist:
+                    if hasattr(model, field.source) or field.required:
+                        raise UnsupportedSerializer('{}.{} is not a model field'.format(
+                            type(serializer).__name__, name))
+                    # the serializer skips read-only fields that the object doesn't have
+                    continue
+                if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+                    fields.append((name, model_field.attname, None))
+                elif type(field) in PLAIN_FIELDS:
+                    fields.append((name, model_field.attname, None))
+                elif isinstance(field, drf_fields.ChoiceField) and not model_field.is_relation:
+                    fields.append((name, model_field.attname, field.to_representation))
+                else:
+                    raise UnsupportedSerializer('{}.{} is a {}'.format(
+                        type(serializer).__name__, name, type(field).__name__))
+            _compiled[key] = (fields, nested)
+        fields, nested = _compiled[key]
+        return fields, {column for name, column, convert in fields if column is not None}, nested
+
+    def to_representation(self, row):
+        data = {}
+        for name, column, convert in self.fields:
+            if column is None:
+                data[name] = None
+                continue
+            value = row[column]
+            data[name] = value if convert is None or value is None else convert(value)
+        if self.markdown is not None:
+            markdown_fields, flag = self.markdown
+            if flag is None or row[flag]:
+                for field in markdown_fields:
+                    if field in data:
+                        data[field + '_html'] = render_markdown(data[field])
+        return data
+
+    def serialize(self, queryset):
+        """
+        Serializes a queryset of the serializer's model. Runs one query, plus one for each nested list.
+
+        :return: A list of dicts, in the order of the queryset
+        """
+        return [data for row, data in self.serialize_rows(queryset)]
+
+    def serialize_rows(self, queryset, extra_columns=()):
+        """
+        Serializes a queryset of the serializer's model, and returns the database rows too.
+
+        :param extra_columns: Other columns to read, e.g., for sorting
+        :return: A list of (row, data) tuples, in the order of the queryset
+        """
+        queryset = queryset.prefetch_related(None)
+        columns = self.columns.union(extra_columns, ['pk'] if self.nested else [])
+        rows = list(queryset.values(*columns))
+        data = [self.to_representation(row) for row in rows]
+        for name, parent_column in self.nested:
+            child_serializer = FastSerializer(self.serializer.fields[name])
+            children = {row['pk']: [] for row in rows}
+            related = child_serializer.model._default_manager.filter(**{parent_column + '__in': list(children)})
+            for row in related.values(parent_column, *child_serializer.columns):
+                children[row[parent_column]].append(child_serializer.to_representation(row))
+            for row, item in zip(rows, data):
+                item[name] = children[row['pk']]
+        return list(zip(rows, data))
+
+
+class FastListMixin:
+    """
+    For viewsets with CachedListMixin. Builds the list with FastSerializer instead of the viewset's serializer.
+    """
+
+    def get_list_data(self, content_updated_at):
+        queryset = self.filter_queryset(self.get_queryset())
+        return FastSerializer(self.get_serializer(queryset, many=True)).serialize(queryset)
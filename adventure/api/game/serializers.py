@@ -3,6 +3,37 @@ from taggit_serializer.serializers import (TagListSerializerField,
                                            TaggitSerializer)
 from adventure.models import Adventure, Author, Room, RoomExit, Artifact, Effect, Monster, \
     Hint, HintAnswer
+from adventure.rendering import has_markdown, render_markdown
+
+
+def html_requested(context):
+    """
+    Checks if the client asked for pre-rendered HTML, with the ?html=1 query parameter
+    """
+    if not has_markdown:
+        return False
+    if 'html' in context:
+        return context['html']
+    request = context.get('request')
+    return request is not None and request.query_params.get('html') in ('1', 'true')
+
+
+class MarkdownHTMLMixin:
+    """
+    Adds a "<field>_html" field with the rendered HTML for each Markdown field, if the client asked for it.
+    """
+    # the fields that contain Markdown
+    markdown_fields = ()
+    # the model field that says whether the text is Markdown. None if it's always Markdown.
+    markdown_flag = 'is_markdown'
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if html_requested(self.context) and (self.markdown_flag is None or getattr(instance, self.markdown_flag)):
+            for field in self.markdown_fields:
+                if field in data:
+                    data[field + '_html'] = render_markdown(data[field])
+        return data
 
 
 class AuthorSerializer(serializers.ModelSerializer):
@@ -12,7 +43,9 @@ class AuthorSerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 
-class AdventureSerializer(serializers.HyperlinkedModelSerializer, TaggitSerializer):
+class AdventureSerializer(MarkdownHTMLMixin, serializers.HyperlinkedModelSerializer, TaggitSerializer):
+    markdown_fields = ('intro_text', )
+    markdown_flag = None
     authors = serializers.StringRelatedField(many=True)
     tags = TagListSerializerField()
 
@@ -22,6 +55,14 @@ class AdventureSerializer(serializers.HyperlinkedModelSerializer, TaggitSerializ
                   'dead_body_id', 'featured_month', 'date_published', 'authors', 'tags', 'times_played', 'avg_ratings')
 
 
+class AdventureCatalogueSerializer(AdventureSerializer):
+    """Serializer used for the adventure catalogue. Leaves out the long text that's only needed to play."""
+
+    class Meta(AdventureSerializer.Meta):
+        fields = tuple(f for f in AdventureSerializer.Meta.fields
+                       if f not in ('full_description', 'intro_text', 'intro_question'))
+
+
 class AdventureDesignSerializer(serializers.HyperlinkedModelSerializer, TaggitSerializer):
     """Serializer used for the designer app. Includes additional info."""
     authors = serializers.StringRelatedField(many=True)
@@ -45,7 +86,8 @@ class RoomExitSerializer(serializers.ModelSerializer):
         fields = ('direction', 'room_to', 'door_id', 'effect_id')
 
 
-class RoomSerializer(serializers.ModelSerializer):
+class RoomSerializer(MarkdownHTMLMixin, serializers.ModelSerializer):
+    markdown_fields = ('description', 'dark_description')
     id = serializers.IntegerField(source='room_id', read_only=True)
     exits = RoomExitSerializer(many=True, read_only=True)
 
@@ -56,31 +98,37 @@ class RoomSerializer(serializers.ModelSerializer):
                   'data', 'exits')
 
 
-class ArtifactSerializer(serializers.ModelSerializer):
+class ArtifactSerializer(MarkdownHTMLMixin, serializers.ModelSerializer):
+    markdown_fields = ('description', )
     id = serializers.IntegerField(source='artifact_id', read_only=True)
 
     class Meta:
         model = Artifact
-        fields = '__all__'
+        exclude = ('updated_at', 'version')
 
 
-class EffectSerializer(serializers.ModelSerializer):
+class EffectSerializer(MarkdownHTMLMixin, serializers.ModelSerializer):
+    markdown_fields = ('text', )
     id = serializers.IntegerField(source='effect_id', read_only=True)
 
     class Meta:
         model = Effect
-        fields = '__all__'
+        exclude = ('updated_at', 'version')
 
 
-class MonsterSerializer(serializers.ModelSerializer):
+class MonsterSerializer(MarkdownHTMLMixin, serializers.ModelSerializer):
+    markdown_fields = ('description', )
     id = serializers.IntegerField(source='monster_id', read_only=True)
 
     class Meta:
         model = Monster
-        fields = '__all__'
+        exclude = ('updated_at', 'version')
 
 
-class HintAnswerSerializer(serializers.ModelSerializer):
+class HintAnswerSerializer(MarkdownHTMLMixin, serializers.ModelSerializer):
+    markdown_fields = ('answer', )
+    markdown_flag = None
+
     class Meta:
         model = HintAnswer
         fields = ('index', 'answer', 'spoiler')
@@ -94,3 +142,11 @@ class HintSerializer(serializers.ModelSerializer):
         model = Hint
         fields = ('id', 'index', 'edx', 'question', 'answers')
 
+
+class HintQuestionSerializer(serializers.ModelSerializer):
+    """Just the question, for the hint index. The answers are loaded separately when the player opens a hint."""
+
+    class Meta:
+        model = Hint
+        fields = ('id', 'index', 'edx', 'question')
+
@@ -1,90 +1,264 @@
 from rest_framework import viewsets, mixins, status
-from django.db.models import Q
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
 
-from adventure.api.game import serializers
+from adventure.api.budget import query_budget
+from adventure.api.renderers import CONTENT_RENDERERS
+from adventure.api.game import catalogue, serializers
+from adventure.api.game.bundle import build_bundle, build_neighborhood, get_general_help, get_hints, serialize_hints
+from adventure.api.game.fast_serializers import FastListMixin
+from adventure.api.mixins import CachedListMixin, ContentCacheMixin, SparseFieldsetMixin
+from adventure.effect_chains import build_effect_chains
+from adventure.name_index import build_name_index
+from adventure.world_index import build_world_index
 from adventure.models import Adventure, Author, Room, Artifact, Effect, Monster, Hint, ActivityLog
 
 
+@query_budget(1)
 class AuthorViewSet(viewsets.ReadOnlyModelViewSet):
     """
     For listing or retrieving authors.
     """
     queryset = Author.objects.filter()
     serializer_class = serializers.AuthorSerializer
+    renderer_classes = CONTENT_RENDERERS
 
     def get_queryset(self):
         queryset = self.queryset
         return queryset
 
 
-class AdventureViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(3, bundle=12, neighborhood=7, catalogue=4, effect_chains=5, world_index=4, name_index=3)
+class AdventureViewSet(SparseFieldsetMixin, ContentCacheMixin, viewsets.ReadOnlyModelViewSet):
     """
     For listing or retrieving adventure data.
     """
     queryset = Adventure.objects.filter(active=True)
     serializer_class = serializers.AdventureSerializer
+    renderer_classes = CONTENT_RENDERERS
     lookup_field = 'slug'
+    # the maximum number of moves for the neighborhood action
+    max_neighborhood_depth = 50
 
     def get_queryset(self):
-        queryset = Adventure.objects.filter(active=True)
+        queryset = Adventure.objects.filter(active=True).with_stats()
         return queryset
 
+    def get_adventure_version_or_404(self, slug):
+        """
+        Gets the ID and content_updated_at of an active adventure, for the actions that don't need the whole record
+        """
+        version = Adventure.objects.filter(active=True, slug=slug).values_list('id', 'content_updated_at').first()
+        if version is None:
+            raise NotFound()
+        return version
 
-class RoomViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False)
+    def catalogue(self, request):
+        """
+        Searches the active adventures, with counts of the tags, authors and featured months in the results.
+
+        Filters: ?tag= (a tag name) and ?author= (an author ID), which can be repeated, ?featured_month= (YYYY-MM),
+        and ?q= (text to search for).
+        """
+        authors = request.query_params.getlist('author')
+        if not all(a.isdigit() for a in authors):
+            raise ValidationError({'author': 'Must be an author ID.'})
+        return Response(catalogue.search(
+            tags=request.query_params.getlist('tag'),
+            authors=[int(a) for a in authors],
+            featured_month=request.query_params.get('featured_month') or None,
+            text=request.query_params.get('q'),
+        ))
+
+    @action(detail=True)
+    def bundle(self, request, slug=None):
+        """
+        All the game data for an adventure (rooms, artifacts, effects, monsters and hints) in one response.
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404(slug)
+        html = serializers.html_requested(self.get_serializer_context())
+        # the full adventure (with its ratings, etc.) is only loaded if the bundle isn't cached
+        return self.cached_response(request, adventure_id, content_updated_at, 'bundle:html' if html else 'bundle',
+                                    lambda: build_bundle(self.get_object(), html))
+
+    @action(detail=True, url_path='effect-chains')
+    def effect_chains(self, request, slug=None):
+        """
+        The effect chains, resolved into the order the effects are printed, plus any cycles and links to effects
+        that don't exist. See adventure/effect_chains.py.
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404(slug)
+        return self.cached_response(request, adventure_id, content_updated_at, 'effect-chains',
+                                    lambda: build_effect_chains(adventure_id))
+
+    @action(detail=True, url_path='world-index')
+    def world_index(self, request, slug=None):
+        """
+        Where everything is at the start of the adventure: the artifacts and monsters in each room, the contents of
+        each container, the monsters' inventories and the exits blocked by each door. See adventure/world_index.py.
+        The bundle includes these too.
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404(slug)
+        return self.cached_response(request, adventure_id, content_updated_at, 'world-index',
+                                    lambda: build_world_index(adventure_id))
+
+    @action(detail=True, url_path='name-index')
+    def name_index(self, request, slug=None):
+        """
+        The names players can use for the artifacts and monsters, and the objects each one refers to, including the
+        names that refer to more than one object. See adventure/name_index.py.
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404(slug)
+        return self.cached_response(request, adventure_id, content_updated_at, 'name-index',
+                                    lambda: build_name_index(adventure_id))
+
+    @action(detail=True, url_path=r'rooms/(?P<room_id>\d+)/neighborhood')
+    def neighborhood(self, request, slug=None, room_id=None):
+        """
+        The rooms within a number of moves of a room (?depth=, default 1), with the artifacts and monsters in them.
+        """
+        depth = request.query_params.get('depth', '1')
+        if not depth.isdigit() or int(depth) > self.max_neighborhood_depth:
+            raise ValidationError({'depth': 'Must be a number from 0 to {}.'.format(self.max_neighborhood_depth)})
+        room_id, depth = int(room_id), int(depth)
+
+        adventure_id, content_updated_at = self.get_adventure_version_or_404(slug)
+        html = serializers.html_requested(self.get_serializer_context())
+
+        def get_data():
+            data = build_neighborhood(adventure_id, room_id, depth, html)
+            if data is None:
+                raise NotFound('Room {} not found.'.format(room_id))
+            return data
+
+        return self.cached_response(request, adventure_id, content_updated_at,
+                                    'neighborhood:{}:{}:{}'.format(room_id, depth, html), get_data)
+
+
+@query_budget(3)
+class RoomViewSet(SparseFieldsetMixin, FastListMixin, CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists room data for an adventure.
     """
-    queryset = Room.objects.all()
+    queryset = Room.objects.prefetch_related('exits')
     serializer_class = serializers.RoomSerializer
+    renderer_classes = CONTENT_RENDERERS
+    cache_name = 'rooms'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class ArtifactViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(2)
+class ArtifactViewSet(SparseFieldsetMixin, FastListMixin, CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists artifact data for an adventure.
     """
     queryset = Artifact.objects.order_by('artifact_id')
     serializer_class = serializers.ArtifactSerializer
+    renderer_classes = CONTENT_RENDERERS
+    cache_name = 'artifacts'
+    allow_streaming = True
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class EffectViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(2)
+class EffectViewSet(SparseFieldsetMixin, FastListMixin, CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists effect data for an adventure.
     """
     queryset = Effect.objects.all()
     serializer_class = serializers.EffectSerializer
+    renderer_classes = CONTENT_RENDERERS
+    cache_name = 'effects'
+    allow_streaming = True
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class MonsterViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(2)
+class MonsterViewSet(SparseFieldsetMixin, FastListMixin, CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists monster data for an adventure.
     """
     queryset = Monster.objects.all().order_by('monster_id')
     serializer_class = serializers.MonsterSerializer
+    renderer_classes = CONTENT_RENDERERS
+    cache_name = 'monsters'
+    allow_streaming = True
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
         return self.queryset.filter(adventure__slug=adventure_id)
 
 
-class HintViewSet(viewsets.ReadOnlyModelViewSet):
+@query_budget(5, questions=4, answers=5)
+class HintViewSet(SparseFieldsetMixin, CachedListMixin, viewsets.ReadOnlyModelViewSet):
     """
     Lists hints for an adventure.
+
+    The questions action lists just the questions, and the answers action gets the answers to one hint, so the
+    client doesn't need to load every answer up front.
     """
-    queryset = Hint.objects.all()
+    queryset = Hint.objects.prefetch_related('answers')
     serializer_class = serializers.HintSerializer
+    renderer_classes = CONTENT_RENDERERS
+    cache_name = 'hints'
+    lookup_value_regex = r'\d+'
 
     def get_queryset(self):
         adventure_id = self.kwargs['adventure_id']
-        return self.queryset.filter(Q(adventure__slug=adventure_id) | Q(question="EAMON GENERAL HELP.", edx="E001")).order_by('index')
+        return self.queryset.filter(adventure__slug=adventure_id).order_by('index')
+
+    def get_list_data(self, content_updated_at):
+        # the general help comes from memory instead of the database
+        queryset = self.filter_queryset(self.get_queryset())
+        return serialize_hints(self.get_serializer(queryset, many=True), queryset, content_updated_at)
+
+    def retrieve(self, request, *args, **kwargs):
+        # the general help is part of every adventure's hints, but not of the queryset
+        content_updated_at = self.get_adventure_version_or_404()[1]
+        hint = next((h for h in get_general_help(content_updated_at) if str(h.pk) == kwargs['pk']), None)
+        if hint is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_serializer(hint).data)
+
+    @action(detail=False)
+    def questions(self, request, adventure_id=None):
+        """
+        The questions of all the hints, without the answers
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404()
+
+        def get_data():
+            hints = get_hints(Hint.objects.filter(adventure_id=adventure_id).only('id', 'index', 'edx', 'question'),
+                              content_updated_at)
+            return serializers.HintQuestionSerializer(hints, many=True).data
+
+        return self.cached_response(request, adventure_id, content_updated_at, 'hints:questions', get_data)
+
+    @action(detail=True)
+    def answers(self, request, adventure_id=None, pk=None):
+        """
+        The answers to one hint
+        """
+        adventure_id, content_updated_at = self.get_adventure_version_or_404()
+
+        def get_data():
+            hint = next((h for h in get_general_help(content_updated_at) if str(h.pk) == pk), None) or \
+                Hint.objects.filter(adventure_id=adventure_id, pk=pk).prefetch_related('answers').first()
+            if hint is None:
+                raise NotFound()
+            return serializers.HintAnswerSerializer(hint.answers.all(), many=True,
+                                                    context=self.get_serializer_context()).data
+
+        return self.cached_response(request, adventure_id, content_updated_at, self.get_cache_name(
+            'hints:{}:answers'.format(pk)), get_data)
@@ -0,0 +1,315 @@
+import hashlib
+import re
+
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
+
+from adventure import content_cache, rendering
+from adventure.dictionary import get_dictionary
+from adventure.models import Adventure
+
+re_accept_encoding = re.compile(r'\b(dcz|br|gzip)\b')
+
+
+class ContentCacheMixin:
+    """
+    Serves responses from the adventure content cache, with conditional GET support.
+
+    The rendered response body is cached for each adventure and output format. Repeat requests that send a matching
+    If-None-Match header, or an If-Modified-Since header that isn't older than the adventure's content_updated_at,
+    get a 304 response with no body.
+
+    The body is compressed with brotli or gzip, or with the shared dictionary for clients that have it (see
+    adventure/dictionary.py).
+
+    If the client asks for pre-rendered HTML (?html=1) and the server can't render Markdown, the response has an
+    "X-Markdown-HTML: unavailable" header, so the client knows to render it itself.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if not rendering.has_markdown and request.query_params.get('html') in ('1', 'true'):
+            response['X-Markdown-HTML'] = 'unavailable'
+        return response
+
+    def cached_response(self, request, adventure_id, content_updated_at, name, get_data):
+        """
+        Renders the data from get_data() with the negotiated renderer, using the content cache.
+        """
+        renderer = request.accepted_renderer
+        if renderer.format == 'api':
+            # the browsable API is for developers and isn't worth caching
+            return Response(get_data())
+
+        # If-Modified-Since can be answered without building or even fetching the payload
+        last_modified = int(content_updated_at.timestamp())
+        response = get_conditional_response(request, last_modified=last_modified)
+        if response is None:
+            def build():
+                # The payload is shared by every client that gets this format, so it's rendered without the
+                # parameters of this request's media type (e.g., "indent=4").
+                return renderer.render(get_data(), renderer.media_type, self.get_renderer_context())
+
+            payload = content_cache.get_payload(
+                adventure_id, content_updated_at, '{}:{}'.format(name, renderer.format), build)
+
+            encoding = self.get_content_encoding(request, payload)
+            etag = '"{}"'.format(payload['etag'] if encoding is None else '{}-{}'.format(payload['etag'], encoding))
+            content_type = renderer.media_type
+            if renderer.charset:
+                content_type = '{}; charset={}'.format(content_type, renderer.charset)
+            if encoding is None:
+                response = HttpResponse(payload['content'], content_type=content_type)
+            else:
+                response = HttpResponse(payload['encodings'][encoding], content_type=content_type)
+                response['Content-Encoding'] = encoding
+            response['ETag'] = etag
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding', 'Available-Dictionary'))
+        dictionary = get_dictionary()
+        if dictionary is not None:
+            response['Link'] = '<{}>; rel="compression-dictionary"'.format(
+                reverse('content-dictionary', args=[dictionary.id]))
+        return response
+
+    @staticmethod
+    def get_content_encoding(request, payload):
+        """
+        Picks the best compressed version of the payload that the client accepts, or None for no compression.
+        """
+        accepted = re_accept_encoding.findall(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if 'dcz' in accepted and 'dcz' in payload['encodings']:
+            dictionary = get_dictionary()
+            # the payload could have been compressed with an older dictionary, before a deploy
+            if dictionary is not None and dictionary.id == payload['dictionary'] \
+                    and dictionary.matches(request.META.get('HTTP_AVAILABLE_DICTIONARY', '')):
+                return 'dcz'
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in payload['encodings']:
+                return encoding
+        return None
+
+
+class CachedListMixin(ContentCacheMixin):
+    """
+    Serves the list action of an adventure's rooms, artifacts, etc. from the adventure content cache.
+
+    Viewsets with allow_streaming can also stream the list as JSON, with ?stream=1. The rows are read with
+    queryset.iterator() and written a chunk at a time, so the whole list is never in memory. Streamed responses
+    aren't cached, so this is meant for the largest adventures.
+    """
+    # the name of the payload in the content cache
+    cache_name = None
+    # whether the list can be streamed. Needs a queryset without prefetch_related(), which iterator() ignores.
+    allow_streaming = False
+    # how many bytes of JSON to send at a time when streaming
+    stream_chunk_size = 64 * 1024
+
+    def get_adventure_version(self):
+        """
+        Gets the adventure's ID and content_updated_at, or None if the adventure doesn't exist
+        """
+        return Adventure.objects.filter(slug=self.kwargs['adventure_id'])\
+            .values_list('id', 'content_updated_at').first()
+
+    def get_adventure_version_or_404(self):
+        version = self.get_adventure_version()
+        if version is None:
+            raise NotFound()
+        return version
+
+    def get_cache_name(self, name=None):
+        """
+        Gets the name of the payload in the content cache, including any query parameters that change the output
+
+        :param name: The base name of the payload. Default is the cache_name attribute.
+        """
+        name = name or self.cache_name
+        params = sorted((key, values) for key, values in self.request.query_params.lists() if key != 'format')
+        if not params:
+            return name
+        return '{}:{}'.format(name, hashlib.sha1(repr(params).encode()).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        version = self.get_adventure_version()
+        if version is None:
+            return super().list(request, *args, **kwargs)
+        adventure_id, content_updated_at = version
+        if self.streaming_requested(request):
+            return self.streaming_response(request, content_updated_at)
+        return self.cached_response(request, adventure_id, content_updated_at, self.get_cache_name(),
+                                    lambda: self.get_list_data(content_updated_at))
+
+    def get_list_data(self, content_updated_at):
+        """
+        Gets the serialized data for the list action
+        """
+        return self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+
+    def streaming_requested(self, request):
+        """
+        Checks if the client asked for a streamed list, in a format that can be streamed
+        """
+        renderer = request.accepted_renderer
+        return (self.allow_streaming and request.query_params.get('stream') in ('1', 'true')
+                and type(renderer) is JSONRenderer
+                and renderer.get_indent(request.accepted_media_type, self.get_renderer_context()) is None)
+
+    def streaming_response(self, request, content_updated_at):
+        """
+        Streams the list as JSON, one row at a time. The output is the same as the regular list action.
+        """
+        last_modified = int(content_updated_at.timestamp())
+        response = get_conditional_response(request, last_modified=last_modified)
+        if response is None:
+            response = StreamingHttpResponse(self.stream_rows(request), content_type=JSONRenderer.media_type)
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept', ))
+        return response
+
+    def stream_rows(self, request):
+        renderer = request.accepted_renderer
+        context = self.get_renderer_context()
+        # the list separator the renderer would use
+        separator = b',' if renderer.compact else b', '
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(queryset, many=True).child
+
+        chunk = [b'[']
+        size = 0
+        for i, instance in enumerate(queryset.iterator()):
+            row = renderer.render(serializer.to_representation(instance), request.accepted_media_type, context)
+            chunk.append(separator + row if i else row)
+            size += len(row)
+            if size >= self.stream_chunk_size:
+                yield b''.join(chunk)
+                chunk = []
+                size = 0
+        chunk.append(b']')
+        yield b''.join(chunk)
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients choose which fields they want, with the "fields" or "exclude" query parameters, e.g.:
+
+        /api/adventures/the-beginners-cave/artifacts?fields=id,name,room_id
+        /api/adventures/the-beginners-cave/monsters?exclude=description,data
+
+    Fields that weren't requested are left out of the SELECT query too, and relations that weren't requested
+    aren't prefetched. Only applies to the list and retrieve actions.
+    """
+
+    def get_sparse_fields(self):
+        """
+        Gets the names of the serializer fields the client asked for, or None if it didn't ask for specific fields.
+        """
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = None
+            fields = self.request.query_params.get('fields')
+            exclude = self.request.query_params.get('exclude')
+            if self.action in ('list', 'retrieve') and (fields or exclude):
+                available = list(self.get_serializer_class()().fields)
+                requested = [f.strip() for f in fields.split(',') if f.strip()] if fields else available
+                excluded = [f.strip() for f in exclude.split(',') if f.strip()] if exclude else []
+                unknown = set(requested + excluded) - set(available)
+                if unknown:
+                    raise ValidationError({'fields': 'Unknown field(s): {}'.format(', '.join(sorted(unknown)))})
+                self._sparse_fields = [f for f in available if f in requested and f not in excluded]
+        return self._sparse_fields
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            target = serializer.child if isinstance(serializer, ListSerializer) else serializer
+            for name in set(target.fields) - set(fields):
+                target.fields.pop(name)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+
+        # the model fields and relations used by the requested serializer fields
+        serializer_fields = self.get_serializer_class()().fields
+        sources = {serializer_fields[name].source.split('.')[0] for name in fields}
+        sources.add(self.lookup_field)
+        # needed to decide whether to render the Markdown fields (see MarkdownHTMLMixin)
+        if getattr(self.get_serializer_class(), 'markdown_flag', None):
+            sources.add(self.get_serializer_class().markdown_flag)
+        model_fields = {f.name for f in queryset.model._meta.concrete_fields}
+
+        # don't join or prefetch relations that weren't requested
+        if isinstance(queryset.query.select_related, dict):
+            select_related = [name for name in queryset.query.select_related if name in sources]
+            queryset = queryset.select_related(None).select_related(*select_related)
+        prefetches = [lookup for lookup in queryset._prefetch_related_lookups
+                      if getattr(lookup, 'prefetch_through', lookup).split('__')[0] in sources]
+        queryset = queryset.prefetch_related(None).prefetch_related(*prefetches)
+        return queryset.only(*(sources & model_fields))
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Somebody else has changed this since you loaded it.'
+    default_code = 'precondition_failed'
+
+
+class ConcurrencyMixin:
+    """
+    Optimistic concurrency for the designer's edits, using the version of each row (see ContentModel).
+
+    The detail responses (retrieve, create, update) have the object's version as their ETag. PUT, PATCH and DELETE
+    requests can send it back in an If-Match header, and get a 412 response if somebody else has saved the object
+    since. Then the client can keep its own copy of the data after saving, instead of loading everything again.
+    Requests without If-Match work as before.
+    """
+
+    @staticmethod
+    def version_etag(version):
+        return '"{}"'.format(version)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        detail_actions = ('retrieve', 'create', 'update', 'partial_update')
+        if self.action in detail_actions and status.is_success(response.status_code) and 'version' in response.data:
+            response['ETag'] = self.version_etag(response.data['version'])
+        return response
+
+    def check_version(self, instance):
+        """
+        Checks the request's If-Match header against the version in the database, and locks the row until the end
+        of the transaction, so nobody else can save it in between.
+        """
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if if_match is None:
+            return
+        etags = parse_etags(if_match)
+        if '*' in etags:
+            return
+        version = type(instance).objects.select_for_update().filter(pk=instance.pk)\
+            .values_list('version', flat=True).first()
+        if self.version_etag(version) not in etags:
+            raise PreconditionFailed()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            self.check_version(serializer.instance)
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            self.check_version(instance)
+            super().perform_destroy(instance)
@@ -0,0 +1,71 @@
+"""
+Compact output formats for the game and designer APIs.
+
+Clients choose the format with the Accept header, or the ?format= query parameter:
+
+- application/vnd.eamon.columnar+json (?format=columnar): JSON with each list of objects sent as a list of
+  column names and a list of rows, so the field names aren't repeated for every row.
+- application/msgpack (?format=msgpack): MessagePack. Only available if the msgpack package is installed.
+"""
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+    has_msgpack = True
+except ImportError:
+    has_msgpack = False
+
+
+def to_columns(data):
+    """
+    Converts each non-empty list of objects in the data into the form {"columns": [...], "rows": [[...], ...]}.
+
+    Nested lists of objects (e.g., room exits) are converted too. Empty lists and lists of other values
+    (e.g., tags) are left as they are.
+    """
+    if isinstance(data, list) and data and all(isinstance(row, dict) for row in data):
+        columns = list(data[0].keys())
+        for row in data[1:]:
+            columns.extend(k for k in row.keys() if k not in columns)
+        return {
+            'columns': columns,
+            'rows': [[to_columns(row.get(c)) for c in columns] for row in data],
+        }
+    if isinstance(data, dict):
+        return {key: to_columns(value) for key, value in data.items()}
+    return data
+
+
+class ColumnarJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer that sends lists of objects as columns and rows. See to_columns().
+    """
+    media_type = 'application/vnd.eamon.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columns(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    MessagePack renderer. Requires the msgpack package.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # handles dates, decimals, etc. the same way as the JSON renderer
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+# the renderers used by the game and designer viewsets
+CONTENT_RENDERERS = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarJSONRenderer, )
+if has_msgpack:
+    CONTENT_RENDERERS += (MessagePackRenderer, )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AdventureConfig(AppConfig):
     name = 'adventure'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,231 @@
+"""
+Cache for the rendered game data of each adventure.
+
+Adventure content only changes when somebody edits it in the designer or the admin, so the game API stores the
+rendered (and compressed) response bodies here. The cache keys include the adventure's content_updated_at, which
+changes whenever the adventure's content changes (see adventure/signals.py and ContentQuerySet), and the version of
+the code (settings.CONTENT_CACHE_VERSION, or the git revision), so a deployment never serves payloads built by the
+old code. Old entries are never read again and simply expire.
+
+The cache can be any cache in settings.CACHES (settings.CONTENT_CACHE_ALIAS). With several processes, use a shared
+one (e.g., Redis, Memcached or the file-based cache), so each payload only gets built once:
+
+- Only one process builds a missing payload. The others wait for it, using a lock made with cache.add(). (The
+  file-based cache's add() isn't atomic, so two processes can occasionally both build it.)
+- Each payload has a soft timeout (settings.CONTENT_CACHE_SOFT_TIMEOUT). After that, one process rebuilds it in a
+  background thread, and the old one is still served until the new one is ready. This keeps the play counts and
+  ratings in the adventure data up to date.
+"""
+import functools
+import gzip
+import hashlib
+import logging
+import subprocess
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+from adventure.dictionary import COMPRESSION_LEVEL, COMPRESSION_LEVEL_OFFLINE, get_dictionary
+
+try:
+    import brotli
+    has_brotli = True
+except ImportError:
+    has_brotli = False
+
+logger = logging.getLogger(__name__)
+
+# how long to keep a rendered payload. Payloads for old content versions are never read again, so this only
+# controls how long they take up space in the cache.
+PAYLOAD_TIMEOUT = 60 * 60 * 24
+
+# how long a process can hold the lock for building a payload, in case it dies while building it
+LOCK_TIMEOUT = 60
+
+# how long to wait for another process to build a payload, before building it anyway
+LOCK_WAIT = 10
+
+# how often to check if the other process has finished building the payload
+POLL_INTERVAL = 0.05
+
+# The brotli quality for the payloads built while a request waits. The best quality (11) takes over a second for a
+# large adventure, for about 10% smaller output, so it's only used for files compressed ahead of time.
+BROTLI_QUALITY = 5
+BROTLI_QUALITY_OFFLINE = 11
+
+
+def get_cache():
+    """
+    Gets the cache used for the adventure content
+    """
+    return caches[getattr(settings, 'CONTENT_CACHE_ALIAS', 'default')]
+
+
+def get_code_version():
+    """
+    Gets the version of the code that builds the payloads, for the cache keys
+    """
+    version = getattr(settings, 'CONTENT_CACHE_VERSION', None)
+    return get_git_revision() if version is None else version
+
+
+@functools.lru_cache(maxsize=None)
+def get_git_revision():
+    """
+    Gets the git revision of the running code, or an empty string if it isn't a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def payload_key(adventure_id, version, name):
+    """
+    Gets the cache key of a payload. See get_payload().
+    """
+    return 'adventure-content:{}:{}:{}:{}'.format(get_code_version(), adventure_id, version.timestamp(), name)
+
+
+def is_shared():
+    """
+    Checks if the content cache is shared between processes. The in-memory cache (Django's default) isn't.
+    """
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def compress(content, offline=False):
+    """
+    Builds the cache entry for a rendered response body, including the ETag and the compressed versions.
+
+    If there's a trained dictionary (see adventure/dictionary.py), the entry also has a version compressed with it,
+    and the ID of the dictionary used.
+
+    :param content: The response body
+    :param offline: True to compress it as well as possible, e.g., for the static bundles, instead of quickly
+    """
+    encodings = {'gzip': gzip.compress(content)}
+    if has_brotli:
+        encodings['br'] = brotli.compress(content, quality=BROTLI_QUALITY_OFFLINE if offline else BROTLI_QUALITY)
+    dictionary = get_dictionary()
+    if dictionary is not None:
+        encodings['dcz'] = dictionary.compress(
+            content, COMPRESSION_LEVEL_OFFLINE if offline else COMPRESSION_LEVEL)
+    return {
+        'etag': hashlib.sha1(content).hexdigest(),
+        'content': content,
+        'encodings': encodings,
+        'dictionary': dictionary.id if dictionary is not None else None,
+    }
+
+
+def get_payload(adventure_id, version, name, build):
+    """
+    Gets a cached payload for an adventure, building it if necessary.
+
+    :param adventure_id: The adventure ID
+    :param version: The adventure's content_updated_at
+    :param name: A name for the payload, unique within the adventure (e.g., "rooms:json")
+    :param build: A function that returns the rendered response body, as bytes
+    :return: A dict with the ETag, the content, and the compressed content for each supported encoding
+    """
+    key = payload_key(adventure_id, version, name)
+    entry = get_cache().get(key)
+    if entry is None:
+        return build_single_flight(key, build)
+    if time.time() > entry['refresh_at'] and acquire_lock(key):
+        run_in_background(lambda: refresh(key, build))
+    return entry['payload']
+
+
+def build_single_flight(key, build):
+    """
+    Builds a missing payload, or waits for the process that's already building it.
+    """
+    cache = get_cache()
+    token = acquire_lock(key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while not token:
+        if time.monotonic() >= deadline:
+            logger.warning('Timed out waiting for %s to be built by another process', key)
+            return store(key, build)
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['payload']
+        # If the lock is gone and there's still no payload, the other process failed to build it (e.g., build()
+        # raised an exception), so build it here.
+        token = acquire_lock(key)
+
+    try:
+        return store(key, build)
+    finally:
+        release_lock(key, token)
+
+
+def refresh(key, build):
+    """
+    Rebuilds a payload whose soft timeout has passed. The caller must hold the lock.
+    """
+    try:
+        store(key, build)
+    except Exception:
+        # the old payload is still in the cache, so the next request will try again
+        logger.exception('Error refreshing %s', key)
+    finally:
+        get_cache().delete(lock_key(key))
+
+
+def store(key, build):
+    """
+    Builds a payload and saves it in the cache, with its soft timeout.
+    """
+    payload = compress(build())
+    soft_timeout = getattr(settings, 'CONTENT_CACHE_SOFT_TIMEOUT', 60 * 10)
+    get_cache().set(key, {'payload': payload, 'refresh_at': time.time() + soft_timeout}, PAYLOAD_TIMEOUT)
+    return payload
+
+
+def lock_key(key):
+    return key + ':lock'
+
+
+def acquire_lock(key):
+    """
+    Tries to get the lock for building a payload.
+
+    :return: A token for releasing the lock, or None if another process has it
+    """
+    token = uuid.uuid4().hex
+    if get_cache().add(lock_key(key), token, LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    """
+    Releases the lock for building a payload, unless it timed out and another process has it now.
+    """
+    cache = get_cache()
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def run_in_background(func):
+    """
+    Runs a function in a background thread, with its own database connection.
+    """
+    def run():
+        try:
+            func()
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
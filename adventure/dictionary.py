@@ -0,0 +1,97 @@
+"""
+Shared zstd dictionary for compressing the game data.
+
+All adventures use the same field names and a lot of the same words, which gzip and brotli have to learn again in
+every response. The train_dictionary management command trains a zstd dictionary from the adventure fixtures in
+adventure/data, and the game API uses it to send dictionary-compressed responses (Content-Encoding: dcz) to clients
+that have it, following the Compression Dictionary Transport standard (RFC 9842):
+
+- Cached game API responses have a Link header pointing to the dictionary. Its URL includes the dictionary's hash, so
+  browsers can cache it forever. The response tells the browser which URLs the dictionary is for (Use-As-Dictionary).
+- The browser sends the hash of the dictionary it has (Available-Dictionary) and "dcz" in Accept-Encoding.
+- If the hash matches the current dictionary, the response is compressed with it.
+
+Requires the zstandard package. Without it, or until the dictionary has been trained, responses use gzip or brotli.
+"""
+import base64
+import hashlib
+import os
+
+from django.conf import settings
+
+try:
+    import zstandard
+    has_zstandard = True
+except ImportError:
+    has_zstandard = False
+
+# the URLs the dictionary is used for
+DICTIONARY_MATCH = '/api/adventures/*'
+
+# A dcz response starts with this, followed by the SHA-256 hash of the dictionary and the compressed data
+DCZ_MAGIC = b'\x5e\x2a\x4d\x18\x20\x00\x00\x00'
+
+# the default dictionary size, in bytes
+DEFAULT_SIZE = 110 * 1024
+
+# The zstd level for the payloads built while a request waits. Level 19 takes about half a second for a large
+# adventure, for about 8% smaller output, so it's only used for files compressed ahead of time.
+COMPRESSION_LEVEL = 6
+COMPRESSION_LEVEL_OFFLINE = 19
+
+_dictionary = {'version': None, 'data': None}
+
+
+class Dictionary:
+    """
+    A trained dictionary, and the hash clients use to refer to it
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.sha256 = hashlib.sha256(data).digest()
+        self.id = self.sha256.hex()
+        self.zstd_dict = zstandard.ZstdCompressionDict(data)
+
+    def matches(self, available_dictionary):
+        """
+        Checks if an Available-Dictionary header is for this dictionary. The header is a structured field byte
+        sequence, i.e., the base64 hash between colons.
+        """
+        return available_dictionary.strip() == ':{}:'.format(base64.b64encode(self.sha256).decode())
+
+    def compress(self, content, level=COMPRESSION_LEVEL):
+        """
+        Compresses a response body in the dcz format
+        """
+        compressor = zstandard.ZstdCompressor(level=level, dict_data=self.zstd_dict)
+        return DCZ_MAGIC + self.sha256 + compressor.compress(content)
+
+
+def get_dictionary():
+    """
+    Gets the current dictionary, or None if there isn't one. The file is only re-read from disk when it changes.
+    """
+    path = getattr(settings, 'CONTENT_DICTIONARY_PATH', None)
+    if not has_zstandard or not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if (path, mtime) != _dictionary['version']:
+        with open(path, 'rb') as f:
+            _dictionary['data'] = Dictionary(f.read())
+        _dictionary['version'] = (path, mtime)
+    return _dictionary['data']
+
+
+def train(samples, size=DEFAULT_SIZE):
+    """
+    Trains a dictionary.
+
+    :param samples: A list of sample response bodies, as bytes
+    :param size: The dictionary size, in bytes
+    :return: The dictionary data
+    """
+    return zstandard.train_dictionary(size, samples).as_bytes()
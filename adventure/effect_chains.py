@@ -0,0 +1,98 @@
+"""
+Resolves the chains of effects in an adventure.
+
+An effect can point to another effect with "next" (printed as a new paragraph) or "next_inline" (printed on the same
+line), and rooms, artifacts and monsters point to effects with "effect" and "effect_inline". The game prints an effect,
+then everything chained from its "next" effect, then everything chained from its "next_inline" effect. Resolving
+the chains on the server gives the client the whole sequence at once, and finds cycles and links to effects that
+don't exist.
+"""
+from adventure.models import Room, Artifact, Effect, Monster
+
+# The longest chain to resolve. Effects that are shared by several branches of a chain get repeated, so a badly
+# linked adventure could otherwise produce huge chains.
+MAX_CHAIN_LENGTH = 1000
+
+# The models that point to effects, and the field with their in-game ID
+REFERRING_MODELS = (
+    (Room, 'room_id'),
+    (Artifact, 'artifact_id'),
+    (Monster, 'monster_id'),
+)
+
+
+def resolve_chains(links, references=()):
+    """
+    Resolves the effect chains.
+
+    :param links: A dict of effect ID => (next, next_inline)
+    :param references: (type, ID, field name, effect ID) for each room, artifact, etc. that points to an effect
+    :return: A dict with:
+        "chains": effect ID => the effects it prints, in order, as {"id": ..., "inline": ...}. Only for effects
+          that are chained to other effects.
+        "cycles": the lists of effect IDs that are chained in a loop
+        "dangling": {"type", "id", "field", "target"} for each link to an effect that doesn't exist
+        "truncated": the IDs of the effects whose chains were longer than MAX_CHAIN_LENGTH
+    """
+    chains = {}
+    cycles = set()
+    truncated = []
+    for effect_id, (next_id, next_inline) in links.items():
+        if next_id is None and next_inline is None:
+            continue
+        chain = []
+        # depth-first, in the same order the game prints them. The stack has (effect ID, inline, path).
+        stack = [(effect_id, False, ())]
+        while stack:
+            current, inline, path = stack.pop()
+            if current not in links:
+                continue  # reported as dangling below
+            if current in path:
+                cycle = path[path.index(current):]
+                # the same cycle can be found starting from any of its effects
+                start = cycle.index(min(cycle))
+                cycles.add(cycle[start:] + cycle[:start])
+                continue
+            if len(chain) == MAX_CHAIN_LENGTH:
+                truncated.append(effect_id)
+                break
+            chain.append({'id': current, 'inline': inline})
+            path = path + (current, )
+            current_next, current_inline = links[current]
+            if current_inline is not None:
+                stack.append((current_inline, True, path))
+            if current_next is not None:
+                stack.append((current_next, False, path))
+        chains[effect_id] = chain
+
+    dangling = []
+    for effect_id, (next_id, next_inline) in sorted(links.items()):
+        for field, target in (('next', next_id), ('next_inline', next_inline)):
+            if target is not None and target not in links:
+                dangling.append({'type': 'effect', 'id': effect_id, 'field': field, 'target': target})
+    for type_name, object_id, field, target in references:
+        if target not in links:
+            dangling.append({'type': type_name, 'id': object_id, 'field': field, 'target': target})
+
+    return {
+        'chains': chains,
+        'cycles': sorted(list(cycle) for cycle in cycles),
+        'dangling': dangling,
+        'truncated': truncated,
+    }
+
+
+def build_effect_chains(adventure_id):
+    """
+    Resolves the effect chains of an adventure. See resolve_chains().
+    """
+    links = {effect_id: (next_id, next_inline) for effect_id, next_id, next_inline in
+             Effect.objects.filter(adventure_id=adventure_id).values_list('effect_id', 'next', 'next_inline')}
+    references = []
+    for model, id_field in REFERRING_MODELS:
+        for object_id, effect, effect_inline in model.objects.filter(adventure_id=adventure_id)\
+                .values_list(id_field, 'effect', 'effect_inline').order_by(id_field):
+            for field, target in (('effect', effect), ('effect_inline', effect_inline)):
+                if target is not None:
+                    references.append((model._meta.model_name, object_id, field, target))
+    return resolve_chains(links, references)
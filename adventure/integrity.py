@@ -0,0 +1,153 @@
+"""
+Referential integrity checks for adventures.
+
+Most of the links between the objects in an adventure are plain numbers with the in-game ID of another object (e.g.,
+RoomExit.room_to, Artifact.container_id, Monster.weapon_id, Effect.next), not foreign keys, so the database doesn't
+stop them from pointing to something that doesn't exist. Those only show up as bugs in the middle of a game. The
+checker loads each type of object once, indexes it by ID, and checks every link in a single pass.
+
+Zero and negative numbers have special meanings in these fields (e.g., room 0 is nowhere, weapon 0 is natural
+weapons, a negative room_to is a special exit), so only positive IDs are checked.
+"""
+from adventure.models import Room, RoomExit, Artifact, Effect, Monster
+
+# The objects that are checked: type => (model, the field with the in-game ID, the fields to load)
+TYPES = {
+    'room': (Room, 'room_id', ('effect', 'effect_inline')),
+    'exit': (RoomExit, 'id', ('room_to', 'door_id', 'effect_id')),
+    'artifact': (Artifact, 'artifact_id', (
+        'room_id', 'monster_id', 'container_id', 'guard_id', 'key_id', 'linked_door_id', 'effect', 'effect_inline',
+        'effect_id', 'num_effects')),
+    'effect': (Effect, 'effect_id', ('next', 'next_inline')),
+    'monster': (Monster, 'monster_id', ('room_id', 'container_id', 'weapon_id', 'count', 'effect', 'effect_inline')),
+}
+
+# The fields that refer to other objects: (type, field, the type it refers to)
+REFERENCES = (
+    ('room', 'effect', 'effect'),
+    ('room', 'effect_inline', 'effect'),
+    ('exit', 'room_to', 'room'),
+    ('exit', 'door_id', 'artifact'),
+    ('exit', 'effect_id', 'effect'),
+    ('artifact', 'room_id', 'room'),
+    ('artifact', 'monster_id', 'monster'),
+    ('artifact', 'container_id', 'artifact'),
+    ('artifact', 'guard_id', 'monster'),
+    ('artifact', 'key_id', 'artifact'),
+    ('artifact', 'linked_door_id', 'artifact'),
+    ('artifact', 'effect', 'effect'),
+    ('artifact', 'effect_inline', 'effect'),
+    ('effect', 'next', 'effect'),
+    ('effect', 'next_inline', 'effect'),
+    ('monster', 'room_id', 'room'),
+    ('monster', 'container_id', 'artifact'),
+    ('monster', 'effect', 'effect'),
+    ('monster', 'effect_inline', 'effect'),
+)
+
+# The fields that refer to a run of objects with consecutive IDs: (type, field, the field with the number of objects,
+# the type they refer to). E.g., a readable artifact has several effects, and a group monster uses one weapon for
+# each member.
+RANGES = (
+    ('artifact', 'effect_id', 'num_effects', 'effect'),
+    ('monster', 'weapon_id', 'count', 'artifact'),
+)
+
+# The links that can't go around in a circle: (type, fields)
+ACYCLIC = (
+    ('artifact', ('container_id', )),
+    ('effect', ('next', 'next_inline')),
+)
+
+
+def check_objects(objects):
+    """
+    Checks the links between the objects in an adventure.
+
+    :param objects: type => a list of dicts with "id" and the fields in TYPES, for each type in TYPES
+    :return: A list of findings, as dicts with "problem" and "type", and:
+        "missing" (a link to an object that doesn't exist): "id", "field" and "target"
+        "duplicate" (two objects with the same ID): "id"
+        "cycle" (e.g., two containers inside each other): "field" and "ids", the IDs in the loop
+    """
+    findings = []
+    index = {}
+    for type_name, rows in objects.items():
+        index[type_name] = {}
+        for row in rows:
+            if row['id'] in index[type_name]:
+                findings.append({'problem': 'duplicate', 'type': type_name, 'id': row['id']})
+            index[type_name][row['id']] = row
+
+    for type_name, field, target_type in REFERENCES:
+        targets = index[target_type]
+        for row in objects[type_name]:
+            target = row[field]
+            if target is not None and target > 0 and target not in targets:
+                findings.append(missing(type_name, row['id'], field, target))
+
+    for type_name, field, count_field, target_type in RANGES:
+        targets = index[target_type]
+        for row in objects[type_name]:
+            first = row[field]
+            if first is None or first <= 0:
+                continue
+            for target in range(first, first + max(row[count_field] or 1, 1)):
+                if target not in targets:
+                    findings.append(missing(type_name, row['id'], field, target))
+
+    for type_name, fields in ACYCLIC:
+        links = {object_id: [row[f] for f in fields if row[f] in index[type_name]]
+                 for object_id, row in index[type_name].items()}
+        for cycle in find_cycles(links):
+            findings.append({'problem': 'cycle', 'type': type_name, 'field': '/'.join(fields), 'ids': cycle})
+
+    return findings
+
+
+def missing(type_name, object_id, field, target):
+    return {'problem': 'missing', 'type': type_name, 'id': object_id, 'field': field, 'target': target}
+
+
+def find_cycles(links):
+    """
+    Finds the loops in a graph, visiting each node and link once.
+
+    :param links: node => the nodes it links to
+    :return: The loops, each starting from its lowest node
+    """
+    # 1 = on the current path, 2 = done
+    state = {}
+    cycles = []
+    for start in sorted(links):
+        if start in state:
+            continue
+        path = [start]
+        state[start] = 1
+        # the stack has the links left to follow from each node on the path
+        stack = [iter(links[start])]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                state[path.pop()] = 2
+                stack.pop()
+            elif node not in state:
+                state[node] = 1
+                path.append(node)
+                stack.append(iter(links[node]))
+            elif state[node] == 1:
+                cycle = path[path.index(node):]
+                start_at = cycle.index(min(cycle))
+                cycles.append(cycle[start_at:] + cycle[:start_at])
+    return sorted(cycles)
+
+
+def check_adventure(adventure_id):
+    """
+    Checks the links between the objects in an adventure, with one query for each type. See check_objects().
+    """
+    objects = {}
+    for type_name, (model, id_field, fields) in TYPES.items():
+        rows = model.objects.filter(adventure_id=adventure_id).values_list(id_field, *fields).order_by(id_field)
+        objects[type_name] = [dict(zip(('id', ) + fields, row)) for row in rows]
+    return check_objects(objects)
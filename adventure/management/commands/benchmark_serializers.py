@@ -0,0 +1,58 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from adventure.api.game import serializers
+from adventure.api.game.fast_serializers import FastSerializer
+from adventure.models import Adventure, Room, Artifact, Effect, Monster, Hint
+
+# (serializer, model, related lookups to prefetch for the regular serializer)
+SERIALIZERS = (
+    (serializers.RoomSerializer, Room, ('exits', )),
+    (serializers.ArtifactSerializer, Artifact, ()),
+    (serializers.EffectSerializer, Effect, ()),
+    (serializers.MonsterSerializer, Monster, ()),
+    (serializers.HintSerializer, Hint, ('answers', )),
+)
+
+
+class Command(BaseCommand):
+    help = '''
+    Compares the speed of the game API serializers with FastSerializer, on the rooms, artifacts, effects, monsters
+    and hints of an adventure, and checks that they give the same output. Includes the database queries.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', nargs='?', type=str,
+                            help='The slug of the adventure to use. Default is the one with the most effects.')
+        parser.add_argument('-n', '--number', type=int, default=10,
+                            help='How many times to serialize each list. Default is 10.')
+
+    def handle(self, *args, **options):
+        adventures = Adventure.objects.all()
+        if options['slug']:
+            adventure = adventures.filter(slug=options['slug']).first()
+        else:
+            adventure = adventures.annotate(num_effects=Count('effects')).order_by('-num_effects').first()
+        if adventure is None:
+            raise CommandError('Adventure not found.')
+        self.stdout.write('{} ({} runs each)'.format(adventure.name, options['number']))
+        self.stdout.write('{:<20} {:>6} {:>12} {:>12} {:>8}'.format('', 'rows', 'DRF (ms)', 'fast (ms)', 'speedup'))
+
+        for serializer_class, model, prefetch in SERIALIZERS:
+            queryset = model.objects.filter(adventure_id=adventure.id).order_by('pk')
+
+            def regular():
+                return serializer_class(queryset.prefetch_related(*prefetch), many=True).data
+
+            def fast():
+                return FastSerializer(serializer_class()).serialize(queryset)
+
+            if regular() != fast():
+                raise CommandError('{} and FastSerializer gave different output.'.format(serializer_class.__name__))
+            regular_time = timeit.timeit(regular, number=options['number']) / options['number']
+            fast_time = timeit.timeit(fast, number=options['number']) / options['number']
+            self.stdout.write('{:<20} {:>6} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+                model.__name__, queryset.count(), regular_time * 1000, fast_time * 1000,
+                regular_time / fast_time if fast_time else 0))
@@ -0,0 +1,61 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from adventure.integrity import check_adventure
+from adventure.models import Adventure
+from adventure.utils import in_worker
+
+
+class Command(BaseCommand):
+    help = '''
+    Checks the links between the rooms, exits, artifacts, effects and monsters of each adventure, e.g., exits to rooms
+    that don't exist, or containers inside each other. See adventure/integrity.py.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', type=str,
+                            help='The slugs of the adventures to check. Default is all adventures.')
+        parser.add_argument('-w', '--workers', type=int, default=4,
+                            help='How many adventures to check at the same time. Default is 4.')
+        parser.add_argument('--json', action='store_true',
+                            help='Write the findings as JSON, as an object of adventure slug => list of findings')
+
+    def handle(self, *args, **options):
+        adventures = Adventure.objects.order_by('slug')
+        if options['slugs']:
+            adventures = adventures.filter(slug__in=options['slugs'])
+        adventures = list(adventures.values_list('slug', 'id'))
+
+        def check(adventure):
+            slug, adventure_id = adventure
+            return slug, check_adventure(adventure_id)
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(in_worker(check), adventures))
+        else:
+            results = list(map(check, adventures))
+
+        if options['json']:
+            self.stdout.write(json.dumps(dict(results), indent=2))
+            return
+        total = 0
+        for slug, findings in results:
+            total += len(findings)
+            for finding in findings:
+                self.stdout.write('{}: {}'.format(slug, describe(finding)))
+        self.stdout.write('Checked {} adventures, found {} problems'.format(len(results), total))
+
+
+def describe(finding):
+    """
+    Describes a finding in words
+    """
+    if finding['problem'] == 'missing':
+        return '{type} {id}: {field} points to {target}, which does not exist'.format(**finding)
+    if finding['problem'] == 'duplicate':
+        return 'more than one {type} with ID {id}'.format(**finding)
+    return '{} {} form a loop through {}'.format(finding['type'], ', '.join(str(i) for i in finding['ids']),
+                                                 finding['field'])
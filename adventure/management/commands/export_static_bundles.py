@@ -0,0 +1,69 @@
+import glob
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from adventure import content_cache
+from adventure.api.game.bundle import build_bundle
+from adventure.models import Adventure
+from adventure.static_bundles import MANIFEST_NAME, bundle_filename
+from adventure.utils import write_file
+
+
+class Command(BaseCommand):
+    help = '''
+    Writes the game data for every active adventure to static JSON files, so the web server can serve them
+    without going through Django. Each file is named after the hash of its content, and has precompressed .gz
+    and .br (if the brotli package is installed) siblings. A manifest.json file has the hash of each adventure's
+    current file, and the content version it was exported from. The files are only used until the adventure is
+    edited, so run this again after editing.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', type=str,
+                            help='The slugs of the adventures to export. Default is all active adventures.')
+        parser.add_argument('-o', '--output', default=settings.STATIC_BUNDLES_DIR,
+                            help='The folder to write the files to. Default is settings.STATIC_BUNDLES_DIR.')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep the files for old versions of the adventures, for clients that might '
+                                 'still be loading them.')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        os.makedirs(output, exist_ok=True)
+
+        adventures = Adventure.objects.filter(active=True).with_stats()
+        if options['slugs']:
+            adventures = adventures.filter(slug__in=options['slugs'])
+
+        manifest_filename = os.path.join(output, MANIFEST_NAME)
+        manifest = {}
+        if options['slugs'] and os.path.exists(manifest_filename):
+            # only updating some of the adventures
+            with open(manifest_filename, 'r') as f:
+                manifest = json.load(f)
+
+        renderer = JSONRenderer()
+        for adventure in adventures:
+            # same renderer and serializers as the bundle API endpoint, so the files match its output
+            payload = content_cache.compress(renderer.render(build_bundle(adventure)), offline=True)
+            file_hash = payload['etag'][:16]
+            filename = os.path.join(output, bundle_filename(adventure.slug, file_hash))
+            write_file(filename, payload['content'])
+            for encoding, extension in (('gzip', '.gz'), ('br', '.br')):
+                if encoding in payload['encodings']:
+                    write_file(filename + extension, payload['encodings'][encoding])
+            manifest[adventure.slug] = {'hash': file_hash,
+                                        'content_updated_at': adventure.content_updated_at.timestamp()}
+
+            if not options['keep_old']:
+                for old_file in glob.glob(os.path.join(output, '{}.*.json*'.format(glob.escape(adventure.slug)))):
+                    if not os.path.basename(old_file).startswith(bundle_filename(adventure.slug, file_hash)):
+                        os.remove(old_file)
+
+            self.stdout.write('{}: {} ({} bytes)'.format(adventure.slug, file_hash, len(payload['content'])))
+
+        write_file(manifest_filename, json.dumps(manifest, indent=2, sort_keys=True).encode())
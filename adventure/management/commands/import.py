@@ -2,7 +2,7 @@ import struct, re, os, regex
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.text import slugify
-from adventure.models import Adventure, Room, RoomExit, Artifact, Effect, Monster
+from adventure.models import Adventure, Room, RoomExit, Artifact, Effect, Monster, batch_content_changes
 
 
 class Command(BaseCommand):
@@ -11,6 +11,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('folder', nargs=1, type=str)
 
+    # records the changes to the adventures once, at the end, instead of for each object saved
+    @batch_content_changes()
     def handle(self, *args, **options):
 
         edx = options['folder'][0]
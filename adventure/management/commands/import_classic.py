@@ -1,6 +1,6 @@
 import os, os.path, regex
 from django.core.management.base import BaseCommand
-from adventure.models import Adventure, Room, RoomExit, Artifact, Effect, Monster
+from adventure.models import Adventure, Room, RoomExit, Artifact, Effect, Monster, batch_content_changes
 from adventure.import_utils import fix_40char_text
 
 
@@ -12,6 +12,8 @@ class Command(BaseCommand):
         parser.add_argument('folder', nargs=1, type=str)
         parser.add_argument('adventure_id', nargs=1, type=int)
 
+    # records the changes to the adventures once, at the end, instead of for each object saved
+    @batch_content_changes()
     def handle(self, folder, adventure_id, *args, **options):
 
         folder = folder[0]
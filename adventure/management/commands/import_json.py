@@ -1,6 +1,7 @@
 import json, os, os.path, regex
 from django.core.management.base import BaseCommand
-from adventure.models import Adventure, Room, RoomExit, Artifact, ArtifactMarking, Effect, Monster
+from adventure.models import Adventure, Room, RoomExit, Artifact, ArtifactMarking, Effect, Monster, \
+    batch_content_changes
 
 
 class Command(BaseCommand):
@@ -18,6 +19,8 @@ class Command(BaseCommand):
                             help='Provide this option to automatically change the names and descriptions'
                                  ' into sentence case.')
 
+    # records the changes to the adventures once, at the end, instead of for each object saved
+    @batch_content_changes()
     def handle(self, folder, adventure_id, *args, **options):
 
         folder = folder[0]
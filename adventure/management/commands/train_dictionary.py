@@ -0,0 +1,115 @@
+import glob
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from adventure import dictionary
+from adventure.content_cache import has_brotli
+from adventure.utils import write_file
+
+if has_brotli:
+    import brotli
+
+# the content models in the fixtures, and the field with their in-game ID
+GAME_MODELS = {
+    'adventure.room': ('rooms', 'room_id'),
+    'adventure.artifact': ('artifacts', 'artifact_id'),
+    'adventure.effect': ('effects', 'effect_id'),
+    'adventure.monster': ('monsters', 'monster_id'),
+    'adventure.hint': ('hints', None),
+}
+
+
+class Command(BaseCommand):
+    help = '''
+    Trains the shared zstd dictionary for compressing the game data (see adventure/dictionary.py) from the adventure
+    fixtures in adventure/data, and reports how much smaller each adventure's game data gets compared to gzip. The
+    sizes are measured on the same adventures the dictionary was trained on, so new adventures will see a bit less.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('-i', '--input', default=os.path.join(settings.BASE_DIR, 'adventure', 'data'),
+                            help='The folder with the fixtures. Default is adventure/data.')
+        parser.add_argument('-o', '--output', default=settings.CONTENT_DICTIONARY_PATH,
+                            help='The file to write the dictionary to. Default is settings.CONTENT_DICTIONARY_PATH.')
+        parser.add_argument('-s', '--size', type=int, default=dictionary.DEFAULT_SIZE,
+                            help='The dictionary size in bytes. Default is {}.'.format(dictionary.DEFAULT_SIZE))
+
+    def handle(self, *args, **options):
+        if not dictionary.has_zstandard:
+            raise CommandError('The zstandard package is not installed.')
+        filenames = sorted(glob.glob(os.path.join(options['input'], '*.json')))
+        if not filenames:
+            raise CommandError('No fixtures found in {}'.format(options['input']))
+
+        renderer = JSONRenderer()
+        bundles = {}
+        samples = []
+        for filename in filenames:
+            with open(filename, 'r') as f:
+                bundle = fixture_to_bundle(json.load(f))
+            bundles[os.path.basename(filename)] = renderer.render(bundle)
+            # one sample per row, so the dictionary learns the field names and the common words
+            samples += [renderer.render(row) for rows in bundle.values() for row in rows]
+
+        data = dictionary.train(samples, options['size'])
+        directory = os.path.dirname(options['output'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_file(options['output'], data)
+        trained = dictionary.Dictionary(data)
+        self.stdout.write('Wrote {} ({} bytes, id {})'.format(options['output'], len(data), trained.id))
+
+        columns = ['raw', 'gzip'] + (['br'] if has_brotli else []) + ['dcz', 'vs gzip']
+        self.stdout.write(('{:<45}' + ' {:>9}' * len(columns)).format('', *columns))
+        totals = {'gzip': 0, 'dcz': 0}
+        for name, content in bundles.items():
+            sizes = [len(content), len(gzip.compress(content))]
+            if has_brotli:
+                sizes.append(len(brotli.compress(content)))
+            sizes.append(len(trained.compress(content)))
+            totals['gzip'] += sizes[1]
+            totals['dcz'] += sizes[-1]
+            self.stdout.write(('{:<45}' + ' {:>9}' * (len(sizes)) + ' {:>8.1f}%').format(
+                name, *sizes, percent_saved(sizes[1], sizes[-1])))
+        self.stdout.write('Total: {} bytes with gzip, {} with the dictionary ({:.1f}% smaller)'.format(
+            totals['gzip'], totals['dcz'], percent_saved(totals['gzip'], totals['dcz'])))
+
+
+def fixture_to_bundle(objects):
+    """
+    Converts the objects in an adventure fixture to roughly the same format as the game API's bundle, e.g., with the
+    in-game IDs as "id" and the room exits inside the rooms.
+    """
+    bundle = {name: [] for name, id_field in GAME_MODELS.values()}
+    rows = {}
+    # (model, foreign key to the parent, parent model, key in the parent) for the rows nested in other rows
+    nested = (
+        ('adventure.roomexit', 'room_from', 'adventure.room', 'exits'),
+        ('adventure.hintanswer', 'hint', 'adventure.hint', 'answers'),
+    )
+    for obj in objects:
+        if obj['model'] in GAME_MODELS:
+            name, id_field = GAME_MODELS[obj['model']]
+            fields = dict(obj['fields'])
+            fields.pop('adventure', None)
+            row = {'id': fields.pop(id_field) if id_field else obj['pk'], **fields}
+            rows[obj['model'], obj['pk']] = row
+            bundle[name].append(row)
+    for model, parent_field, parent_model, key in nested:
+        for obj in objects:
+            if obj['model'] == model:
+                fields = dict(obj['fields'])
+                fields.pop('adventure', None)
+                parent = rows.get((parent_model, fields.pop(parent_field)))
+                if parent is not None:
+                    parent.setdefault(key, []).append(fields)
+    return bundle
+
+
+def percent_saved(before, after):
+    return 100 * (before - after) / before if before else 0
@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.test import RequestFactory
+from django.urls import resolve
+
+from adventure import content_cache
+from adventure.api.game.bundle import general_help_filter
+from adventure.models import Adventure, Hint
+from adventure.utils import in_worker
+
+# the game API endpoints that are served from the content cache, for each adventure
+CACHED_PATHS = (
+    'bundle',
+    'effect-chains',
+    'world-index',
+    'name-index',
+    'rooms',
+    'artifacts',
+    'effects',
+    'monsters',
+    'hints',
+    'hints/questions',
+)
+
+# the ones that can include pre-rendered Markdown, with ?html=1
+HTML_PATHS = ('bundle', 'rooms', 'artifacts', 'effects', 'monsters', 'hints')
+
+
+class Command(BaseCommand):
+    help = '''
+    Fills the adventure content cache with the game API responses for every active adventure, so the first players
+    after a deployment don't have to wait for them to be built. This only helps if the content cache is shared with
+    the web server processes (see CONTENT_CACHE_ALIAS in settings.py), so it does nothing otherwise. The responses
+    are built for the version of the code this runs with (see CONTENT_CACHE_VERSION), so run it after updating the
+    code and before restarting the web server.
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', type=str,
+                            help='The slugs of the adventures to warm up. Default is all active adventures.')
+        parser.add_argument('-w', '--workers', type=int, default=4,
+                            help='How many adventures to work on at the same time. Default is 4.')
+        parser.add_argument('-f', '--format', action='append', dest='formats',
+                            help='An API format to build (e.g., json, columnar, msgpack). Can be repeated. '
+                                 'Default is json.')
+        parser.add_argument('--html', action='store_true',
+                            help='Also build the responses with pre-rendered Markdown (?html=1)')
+        parser.add_argument('--force', action='store_true',
+                            help="Build the responses even if the content cache isn't shared with the web server")
+
+    def handle(self, *args, **options):
+        if not content_cache.is_shared() and not options['force']:
+            self.stdout.write("The content cache isn't shared with the web server processes, so there's nothing to "
+                              "warm up. See CONTENT_CACHE_ALIAS in settings.py.")
+            return
+        adventures = Adventure.objects.filter(active=True)
+        if options['slugs']:
+            adventures = adventures.filter(slug__in=options['slugs'])
+        slugs = list(adventures.values_list('slug', flat=True))
+        formats = options['formats'] or ['json']
+        start = time.perf_counter()
+
+        def warm(slug):
+            return slug, warm_adventure(slug, formats, options['html'])
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = pool.map(in_worker(warm), slugs)
+                self.write_results(results)
+        else:
+            self.write_results(map(warm, slugs))
+        self.stdout.write('Warmed up {} adventures in {:.2f}s'.format(len(slugs), time.perf_counter() - start))
+
+    def write_results(self, results):
+        for slug, (count, seconds) in results:
+            self.stdout.write('{}: {} responses in {:.2f}s'.format(slug, count, seconds))
+
+
+def warm_adventure(slug, formats, html=False):
+    """
+    Builds all the cached game API responses for an adventure, by calling the API views.
+
+    :return: The number of responses, and how long it took in seconds
+    """
+    start = time.perf_counter()
+    factory = RequestFactory()
+    hints = Hint.objects.filter(Q(adventure__slug=slug) | general_help_filter()).values_list('pk', flat=True)
+    paths = list(CACHED_PATHS) + ['hints/{}/answers'.format(pk) for pk in hints]
+    count = 0
+    for path in paths:
+        url = '/api/adventures/{}/{}'.format(slug, path)
+        match = resolve(url)
+        variants = [{}]
+        if html and (path in HTML_PATHS or path.endswith('/answers')):
+            variants.append({'html': '1'})
+        for fmt in formats:
+            for params in variants:
+                request = factory.get(url, dict(params, format=fmt))
+                response = match.func(request, *match.args, **match.kwargs)
+                if response.status_code != 200:
+                    raise CommandError('{} returned {}'.format(url, response.status_code))
+                count += 1
+    return count, time.perf_counter() - start
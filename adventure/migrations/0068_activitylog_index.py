@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventure', '0067_roomexit_hintanswer_adventure_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['adventure', 'type'], name='adventure_a_adventu_bd0c6b_idx'),
+        ),
+    ]
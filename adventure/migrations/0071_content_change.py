@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventure', '0070_content_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=10)),
+                ('object_id', models.IntegerField(null=True)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('adventure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='adventure.adventure')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='contentchange',
+            index=models.Index(fields=['adventure', 'id'], name='adventure_c_adventu_d3eea2_idx'),
+        ),
+    ]
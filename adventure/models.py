@@ -1,4 +1,10 @@
+import threading
+from contextlib import contextmanager
+
+from django.apps import apps
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from taggit.managers import TaggableManager
 
 ARTIFACT_TYPES = (
@@ -58,6 +64,32 @@ class Author(models.Model):
         return self.name
 
 
+class AdventureQuerySet(models.QuerySet):
+    def with_stats(self):
+        """
+        Annotates the play count and the average ratings, and prefetches the authors and tags, so a list of
+        adventures can be serialized with a fixed number of queries.
+        """
+        # Subqueries rather than joins, so the log and ratings rows aren't multiplied together and the query
+        # doesn't need a GROUP BY (which would also drop the default ordering).
+        rating = apps.get_model('player', 'Rating')
+        ratings = rating.objects.filter(adventure_id=models.OuterRef('pk')).order_by().values('adventure_id')
+        times_played = ActivityLog.objects.filter(adventure_id=models.OuterRef('pk'), type='start adventure')\
+            .order_by().values('adventure_id').annotate(count=models.Count('*')).values('count')
+        return self.annotate(
+            times_played_count=Coalesce(models.Subquery(times_played), 0),
+            avg_overall=models.Subquery(ratings.annotate(avg=models.Avg('overall')).values('avg')),
+            avg_combat=models.Subquery(ratings.annotate(avg=models.Avg('combat')).values('avg')),
+            avg_puzzle=models.Subquery(ratings.annotate(avg=models.Avg('puzzle')).values('avg')),
+        ).prefetch_related('authors', 'tags')
+
+    def content_changed(self):
+        """
+        Records that the content (rooms, artifacts, etc.) of the adventures has changed.
+        """
+        return self.update(content_updated_at=timezone.now())
+
+
 class Adventure(models.Model):
     name = models.CharField(max_length=50)
     description = models.TextField(default='', blank=True)
@@ -92,16 +124,32 @@ class Adventure(models.Model):
     featured_month = models.CharField(null=True, blank=True, max_length=7)
     tags = TaggableManager(blank=True)
     authors = models.ManyToManyField(Author)
+    # when the adventure or any of its rooms, artifacts, etc. last changed. Used for caching the game data.
+    content_updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = AdventureQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, **kwargs):
+        # the adventure's own fields are part of the game data, too
+        self.content_updated_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'content_updated_at'}
+        super().save(**kwargs)
+
     @property
     def times_played(self):
+        # use the value from AdventureQuerySet.with_stats(), if it was loaded that way
+        if hasattr(self, 'times_played_count'):
+            return self.times_played_count
         return ActivityLog.objects.filter(type='start adventure', adventure_id=self.id).count()
 
     @property
     def avg_ratings(self):
+        if hasattr(self, 'avg_overall'):
+            return {'overall__avg': self.avg_overall, 'combat__avg': self.avg_combat, 'puzzle__avg': self.avg_puzzle}
         return self.ratings.all().aggregate(models.Avg('overall'), models.Avg('combat'), models.Avg('puzzle'))
 
     @property
@@ -124,7 +172,160 @@ class Adventure(models.Model):
         ordering = ['name']
 
 
-class Room(models.Model):
+# the adventures changed inside a batch_content_changes() block, in this thread
+_batch = threading.local()
+
+
+def content_changed(adventure_ids):
+    """
+    Records that the content of some adventures has changed. An ID of None means the content isn't part of any
+    one adventure (e.g., the general help hint), so all the adventures are marked as changed.
+    """
+    pending = getattr(_batch, 'adventure_ids', None)
+    if pending is not None:
+        pending.update(adventure_ids)
+        return
+    adventures = Adventure.objects.all()
+    if None not in adventure_ids:
+        adventures = adventures.filter(pk__in=adventure_ids)
+    adventures.content_changed()
+
+
+# the adventures being deleted in this thread (see adventure/signals.py). The content deleted along with them isn't
+# added to the change log, which is deleted with them too.
+_deleting = threading.local()
+
+
+def deleting_adventures():
+    """
+    Gets the IDs of the adventures being deleted in this thread
+    """
+    if getattr(_deleting, 'adventure_ids', None) is None:
+        _deleting.adventure_ids = set()
+    return _deleting.adventure_ids
+
+
+def log_changes(model, rows):
+    """
+    Adds rows to the change log (see ContentChange), for the models that are in it.
+
+    :param model: The content model
+    :param rows: (adventure ID, the object's ID in the API) for each created, changed or deleted object
+    """
+    if model.change_type is None:
+        return
+    deleting = deleting_adventures()
+    changes = [ContentChange(adventure_id=adventure_id, type=model.change_type, object_id=object_id)
+               for adventure_id, object_id in rows if adventure_id is not None and adventure_id not in deleting]
+    pending = getattr(_batch, 'changes', None)
+    if pending is not None:
+        pending.extend(changes)
+    elif changes:
+        ContentChange.objects.bulk_create(changes)
+
+
+@contextmanager
+def batch_content_changes():
+    """
+    Records the content changes made inside the block with one query at the end, instead of one for each object
+    saved or deleted and each bulk operation. The same goes for the change log.
+    """
+    if getattr(_batch, 'adventure_ids', None) is not None:
+        # already in a batch
+        yield
+        return
+    _batch.adventure_ids = set()
+    _batch.changes = []
+    try:
+        yield
+        adventure_ids, changes = _batch.adventure_ids, _batch.changes
+    finally:
+        _batch.adventure_ids = _batch.changes = None
+    if adventure_ids:
+        content_changed(adventure_ids)
+    if changes:
+        # the change feed's settle time counts from when the rows are written
+        now = timezone.now()
+        for change in changes:
+            change.changed_at = now
+        ContentChange.objects.bulk_create(changes)
+
+
+class ContentQuerySet(models.QuerySet):
+    """
+    QuerySet for the adventure content models. The bulk operations don't send the post_save signal, so these
+    record the change on the adventures themselves. They also increment the version of each row.
+    """
+    def update(self, **kwargs):
+        # the change log needs the ID of each object
+        changed = list(self.order_by().values_list('adventure_id', self.model.change_id_field))
+        kwargs.setdefault('updated_at', timezone.now())
+        kwargs.setdefault('version', models.F('version') + 1)
+        rows = super().update(**kwargs)
+        if changed:
+            content_changed({adventure_id for adventure_id, object_id in changed})
+            log_changes(self.model, changed)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            content_changed({obj.adventure_id for obj in objs})
+            log_changes(self.model, [(obj.adventure_id, obj.change_id) for obj in objs])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+            obj.version += 1
+        # the change log is written by update(), which Django's bulk_update() calls
+        rows = super().bulk_update(objs, set(fields) | {'updated_at', 'version'}, *args, **kwargs)
+        if objs:
+            content_changed({obj.adventure_id for obj in objs})
+        return rows
+
+
+class ContentModel(models.Model):
+    """
+    Base class for the models that make up an adventure's content (rooms, artifacts, etc.)
+
+    The version goes up by one each time the row is saved. The designer API uses it for optimistic concurrency (see
+    ConcurrencyMixin in adventure/api/mixins.py).
+    """
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = ContentQuerySet.as_manager()
+
+    # For the models in the designer's change feed (see ContentChange): the name of the list in the designer API,
+    # and the field that the API calls "id"
+    change_type = None
+    change_id_field = 'pk'
+
+    class Meta:
+        abstract = True
+
+    @property
+    def change_id(self):
+        return getattr(self, self.change_id_field)
+
+    def save(self, **kwargs):
+        self.updated_at = timezone.now()
+        adding = self._state.adding
+        if not adding:
+            # in the database, so two processes saving the same row can't both end up with the same version
+            self.version = models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at', 'version'}
+        super().save(**kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['version'])
+
+
+class Room(ContentModel):
+    change_type = 'rooms'
+    change_id_field = 'room_id'
     adventure = models.ForeignKey(Adventure, on_delete=models.CASCADE, related_name='rooms')
     room_id = models.IntegerField(default=0)  # The in-game room ID.
     name = models.CharField(max_length=255)
@@ -153,7 +354,8 @@ class Room(models.Model):
         return self.name
 
 
-class RoomExit(models.Model):
+class RoomExit(ContentModel):
+    change_type = 'exits'
     adventure = models.ForeignKey(Adventure, on_delete=models.CASCADE, related_name='room_exits', null=True)
     direction = models.CharField(max_length=2)
     room_from = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='exits')
@@ -169,12 +371,18 @@ class RoomExit(models.Model):
         return str(self.room_from) + " " + self.direction
 
     def save(self, **kwargs):
-        if self.room_from and self.adventure_id != self.room_from.adventure_id:
+        # copy the adventure from the room, without loading the room just for that
+        if RoomExit.room_from.is_cached(self):
             self.adventure_id = self.room_from.adventure_id
+        elif self.adventure_id is None and self.room_from_id is not None:
+            self.adventure_id = Room.objects.filter(pk=self.room_from_id).values_list('adventure_id', flat=True)\
+                .first()
         super().save(**kwargs)
 
 
-class Artifact(models.Model):
+class Artifact(ContentModel):
+    change_type = 'artifacts'
+    change_id_field = 'artifact_id'
     adventure = models.ForeignKey(Adventure, on_delete=models.CASCADE, related_name='artifacts')
     artifact_id = models.IntegerField(default=0)  # The in-game artifact ID.
     article = models.CharField(max_length=20, null=True, blank=True,
@@ -290,7 +498,9 @@ class ArtifactMarking(models.Model):
     marking = models.TextField(max_length=65535)
 
 
-class Effect(models.Model):
+class Effect(ContentModel):
+    change_type = 'effects'
+    change_id_field = 'effect_id'
     STYLES = (
         ('', 'Normal'),
         ('emphasis', 'Bold'),
@@ -314,7 +524,9 @@ class Effect(models.Model):
         return self.text[0:50]
 
 
-class Monster(models.Model):
+class Monster(ContentModel):
+    change_type = 'monsters'
+    change_id_field = 'monster_id'
     FRIENDLINESS = (
         ('friend', 'Always Friendly'),
         ('neutral', 'Always Neutral'),
@@ -398,7 +610,7 @@ class Monster(models.Model):
         return self.name
 
 
-class Hint(models.Model):
+class Hint(ContentModel):
     """
     Represents a hint for the adventure hints system
     """
@@ -411,7 +623,7 @@ class Hint(models.Model):
         return self.question
 
 
-class HintAnswer(models.Model):
+class HintAnswer(ContentModel):
     """
     Represents an answer to a hint. Each hint may have more than one answer.
     """
@@ -506,6 +718,28 @@ class PlayerArtifact(models.Model):
         return "{} {}".format(self.player, self.name)
 
 
+class ContentChange(models.Model):
+    """
+    Append-only log of the changes to the rooms, exits, artifacts, effects and monsters of each adventure, for the
+    designer's change feed. The ID is the cursor the designer polls with. Written by the signals in
+    adventure/signals.py and by ContentQuerySet.
+
+    A row only says which object was touched. The feed looks up its current state, so an object that was deleted and
+    created again, for example, comes out right.
+    """
+    adventure = models.ForeignKey(Adventure, on_delete=models.CASCADE, related_name='+')
+    type = models.CharField(max_length=10)  # e.g., "rooms". See ContentModel.change_type
+    # The object's ID in the designer API. None if it's not known, e.g., for exits created with bulk_create() on a
+    # database that doesn't return the new primary keys.
+    object_id = models.IntegerField(null=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['adventure', 'id']),
+        ]
+
+
 class ActivityLog(models.Model):
     """
     Used to track player activity (going on adventures, etc.)
@@ -515,3 +749,9 @@ class ActivityLog(models.Model):
     value = models.IntegerField(null=True, blank=True)
     adventure = models.ForeignKey(Adventure, on_delete=models.CASCADE, related_name='activity_log', null=True)
     created = models.DateTimeField(auto_now_add=True, null=True)
+
+    class Meta:
+        indexes = [
+            # for counting the number of times each adventure was played
+            models.Index(fields=['adventure', 'type']),
+        ]
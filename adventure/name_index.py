@@ -0,0 +1,90 @@
+"""
+Index of the names that players can use for the artifacts and monsters in an adventure.
+
+The game's parser matches what the player types against each artifact's name and synonyms, and each monster's name,
+plural name and synonyms. Doing that at runtime means splitting and lowercasing the synonyms of every object for each
+command. This builds a lookup table from each normalized name to the objects it refers to, once per content version,
+and lists the names that refer to more than one object, so the designer can catch them before players do.
+
+The index only has whole names. The parser also matches the beginning or end of a name (e.g., "potion" for "healing
+potion"), which still needs a scan, but it can try the index first.
+"""
+import re
+
+from adventure.models import Artifact, Monster
+
+re_whitespace = re.compile(r'\s+')
+
+
+def normalize(name):
+    """
+    Normalizes a name or synonym the way the parser compares them: lower case, with single spaces.
+    """
+    return re_whitespace.sub(' ', name).strip().lower()
+
+
+def split_synonyms(synonyms):
+    """
+    Splits the comma-separated synonyms of an artifact or monster into normalized names.
+    """
+    return [normalize(s) for s in (synonyms or '').split(',') if s.strip()]
+
+
+def index_names(artifacts, monsters):
+    """
+    Builds the name index.
+
+    :param artifacts: (artifact ID, name, article, synonyms, linked door ID) for each artifact
+    :param monsters: (monster ID, name, article, name_plural, synonyms) for each monster
+    :return: A dict with:
+        "names": normalized name => the objects it refers to, as {"type": ..., "id": ...}
+        "ambiguous": the same, for just the names that refer to more than one object. The two sides of a
+          two-sided door (see Artifact.linked_door_id) usually share a name, so they don't count as ambiguous.
+    """
+    names = {}
+    linked_doors = {}
+
+    def add(type_name, object_id, *object_names):
+        entry = {'type': type_name, 'id': object_id}
+        for name in object_names:
+            if name and entry not in names.setdefault(name, []):
+                names[name].append(entry)
+
+    for artifact_id, name, article, synonyms, linked_door_id in sorted(artifacts, key=lambda a: a[0]):
+        name = normalize(name)
+        add('artifact', artifact_id, name, normalize('{} {}'.format(article, name)) if article else None,
+            *split_synonyms(synonyms))
+        if linked_door_id:
+            linked_doors[artifact_id] = linked_door_id
+
+    for monster_id, name, article, name_plural, synonyms in sorted(monsters, key=lambda m: m[0]):
+        name = normalize(name)
+        add('monster', monster_id, name, normalize('{} {}'.format(article, name)) if article else None,
+            normalize(name_plural or ''), *split_synonyms(synonyms))
+
+    ambiguous = {}
+    for name, entries in sorted(names.items()):
+        if len(entries) < 2:
+            continue
+        if len(entries) == 2 and all(e['type'] == 'artifact' for e in entries):
+            a, b = entries[0]['id'], entries[1]['id']
+            if linked_doors.get(a) == b or linked_doors.get(b) == a:
+                continue
+        ambiguous[name] = entries
+
+    return {
+        'names': names,
+        'ambiguous': ambiguous,
+    }
+
+
+def build_name_index(adventure_id):
+    """
+    Builds the name index of an adventure. See index_names().
+    """
+    return index_names(
+        Artifact.objects.filter(adventure_id=adventure_id)
+        .values_list('artifact_id', 'name', 'article', 'synonyms', 'linked_door_id'),
+        Monster.objects.filter(adventure_id=adventure_id)
+        .values_list('monster_id', 'name', 'article', 'name_plural', 'synonyms'),
+    )
@@ -0,0 +1,53 @@
+"""
+Server-side rendering of the Markdown text in adventure content (room descriptions, effects, hint answers, etc.)
+
+The game API can send pre-rendered HTML next to the Markdown (see MarkdownHTMLMixin in adventure/api/game/serializers.py)
+so the client doesn't have to parse the Markdown every time it displays something. The HTML is cached by the hash of
+the source text, so it's only rendered again when the text changes.
+
+Requires the markdown package. Without it, no HTML is sent, and the responses say so with an "X-Markdown-HTML:
+unavailable" header (see ContentCacheMixin), so the client renders the Markdown itself.
+"""
+import functools
+import hashlib
+
+import bleach
+
+from adventure.content_cache import get_cache
+
+try:
+    import markdown
+    has_markdown = True
+except ImportError:
+    has_markdown = False
+
+# The tags and attributes allowed in the rendered HTML. Adventure text sometimes has inline HTML, e.g., for colors.
+ALLOWED_TAGS = list(bleach.sanitizer.ALLOWED_TAGS) + [
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'span', 'div', 'img',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+]
+ALLOWED_ATTRIBUTES = {
+    '*': ['class'],
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'img': ['src', 'alt', 'title'],
+}
+
+# how long to keep rendered HTML in the shared cache
+RENDER_TIMEOUT = 60 * 60 * 24 * 30
+
+
+@functools.lru_cache(maxsize=4096)
+def render_markdown(text):
+    """
+    Renders Markdown text to sanitized HTML, using the render cache.
+    """
+    if not text:
+        return text
+    key = 'markdown-html:{}'.format(hashlib.sha1(text.encode()).hexdigest())
+    html = get_cache().get(key)
+    if html is None:
+        html = bleach.clean(markdown.markdown(text), tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True)
+        get_cache().set(key, html, RENDER_TIMEOUT)
+    return html
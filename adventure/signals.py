@@ -0,0 +1,76 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from adventure.models import Adventure, Author, Room, RoomExit, Artifact, Effect, Monster, Hint, HintAnswer, \
+    content_changed, deleting_adventures, log_changes
+
+CONTENT_MODELS = (Room, RoomExit, Artifact, Effect, Monster, Hint, HintAnswer)
+
+
+def content_saved(sender, instance, **kwargs):
+    """
+    Updates the adventure's content_updated_at when its rooms, artifacts, etc. change. This is the version of the
+    cached game data.
+    """
+    if sender in (Hint, HintAnswer) and (instance.adventure_id is None or
+                                        getattr(instance, 'question', None) == 'EAMON GENERAL HELP.'):
+        # The general help hint doesn't belong to an adventure, and is shown in all adventures.
+        content_changed({None})
+    elif instance.adventure_id is not None and instance.adventure_id not in deleting_adventures():
+        # (the content deleted along with an adventure doesn't need to update it)
+        content_changed({instance.adventure_id})
+
+
+def log_content_change(sender, instance, raw=False, **kwargs):
+    """
+    Adds saved and deleted rooms, exits, etc. to the designer's change feed (see ContentChange)
+    """
+    if raw:
+        # loading a fixture
+        return
+    log_changes(sender, [(instance.adventure_id, instance.change_id)])
+
+
+def adventure_deleting(sender, instance, **kwargs):
+    """
+    Stops the change log from being written for the rooms, artifacts, etc. deleted along with an adventure
+    """
+    deleting_adventures().add(instance.pk)
+
+
+def adventure_deleted(sender, instance, **kwargs):
+    deleting_adventures().discard(instance.pk)
+
+
+def adventure_relations_changed(sender, instance, action, pk_set=None, **kwargs):
+    """
+    Updates the adventure's content_updated_at when its authors or tags change
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Adventure):
+        content_changed({instance.id})
+    elif isinstance(instance, Author) and pk_set:
+        # changed from the author's side, e.g., author.adventure_set.add(...)
+        content_changed(pk_set)
+
+
+def author_saved(sender, instance, **kwargs):
+    """
+    Updates the content_updated_at of an author's adventures when the author's name changes
+    """
+    content_changed(set(instance.adventure_set.values_list('id', flat=True)))
+
+
+for model in CONTENT_MODELS:
+    post_save.connect(content_saved, sender=model, dispatch_uid='content_saved')
+    post_delete.connect(content_saved, sender=model, dispatch_uid='content_deleted')
+    if model.change_type:
+        post_save.connect(log_content_change, sender=model, dispatch_uid='log_content_saved')
+        post_delete.connect(log_content_change, sender=model, dispatch_uid='log_content_deleted')
+pre_delete.connect(adventure_deleting, sender=Adventure, dispatch_uid='adventure_deleting')
+post_delete.connect(adventure_deleted, sender=Adventure, dispatch_uid='adventure_deleted')
+post_save.connect(author_saved, sender=Author, dispatch_uid='author_saved')
+m2m_changed.connect(adventure_relations_changed, sender=Adventure.authors.through,
+                    dispatch_uid='adventure_authors_changed')
+m2m_changed.connect(adventure_relations_changed, sender=Adventure.tags.through,
+                    dispatch_uid='adventure_tags_changed')
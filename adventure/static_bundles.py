@@ -0,0 +1,54 @@
+"""
+Static copies of the adventure bundles, for serving directly from the web server.
+
+The export_static_bundles management command writes each active adventure's bundle (the same JSON as the
+/api/adventures/<slug>/bundle endpoint) to a file named after its content hash, with precompressed .gz and .br
+siblings, plus a manifest with the hash of each adventure's current file and the content version
+(Adventure.content_updated_at) it was exported from. Nothing exports the bundles again when an adventure is edited,
+so a bundle is only used while the adventure's content is still the same.
+"""
+import json
+import os
+
+from django.conf import settings
+
+from adventure.models import Adventure
+
+MANIFEST_NAME = 'manifest.json'
+
+_manifest = {'mtime': None, 'data': {}}
+
+
+def bundle_filename(slug, file_hash):
+    return '{}.{}.json'.format(slug, file_hash)
+
+
+def read_manifest():
+    """
+    Reads the bundle manifest. The manifest is only re-read from disk when the file changes.
+    """
+    path = os.path.join(settings.STATIC_BUNDLES_DIR, MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if mtime != _manifest['mtime']:
+        with open(path, 'r') as f:
+            _manifest['data'] = json.load(f)
+        _manifest['mtime'] = mtime
+    return _manifest['data']
+
+
+def bundle_url(slug):
+    """
+    Gets the URL of the static bundle for an adventure, or None if it hasn't been exported or the adventure has
+    changed since.
+    """
+    entry = read_manifest().get(slug)
+    if not isinstance(entry, dict):
+        # not exported, or by an older version without the content version
+        return None
+    content_updated_at = Adventure.objects.filter(slug=slug).values_list('content_updated_at', flat=True).first()
+    if content_updated_at is None or content_updated_at.timestamp() != entry['content_updated_at']:
+        return None
+    return settings.STATIC_BUNDLES_URL + bundle_filename(slug, entry['hash'])
@@ -1,6 +1,49 @@
-from django.test import TestCase
-from django.urls import reverse
-from .models import Adventure, ActivityLog, Room
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from unittest import skipUnless
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from player.models import Player, PlayerArtifact, PlayerProfile, Rating, SavedGame
+from . import content_cache, rendering
+from .api.budget import get_query_budget
+from .api.designer import views as designer_views
+from .api.game import serializers
+from .api.game.fast_serializers import FastSerializer
+from .api.renderers import has_msgpack, to_columns
+from .dictionary import has_zstandard
+from .management.commands.benchmark_serializers import SERIALIZERS
+from .models import Adventure, ActivityLog, Artifact, Author, ContentChange, Effect, Hint, HintAnswer, Monster, Room, \
+    RoomExit, batch_content_changes
+from .integrity import check_objects
+from .name_index import index_names
+from .rendering import has_markdown
+from .static_bundles import bundle_url
+from .urls import router, designer_router
+
+if has_zstandard:
+    import zstandard
+
+BEGINNERS_CAVE = os.path.join(settings.BASE_DIR, 'adventure/data/001-the-beginners-cave.json')
 
 
 class AdventureTest(TestCase):
@@ -20,6 +63,16 @@ class AdventureTest(TestCase):
         self.assertEqual(str(a2), "Test Adventure 2")
         self.assertEqual(a2.times_played, 1)
 
+    def test_with_stats(self):
+        Rating.objects.create(adventure_id=1, overall=5, combat=2, puzzle=4)
+        Rating.objects.create(adventure_id=1, overall=3, combat=4, puzzle=4)
+        adventures = list(Adventure.objects.with_stats().order_by('id'))
+        for a in adventures:
+            self.assertEqual(a.times_played, Adventure.objects.get(pk=a.id).times_played)
+            self.assertEqual(a.avg_ratings, Adventure.objects.get(pk=a.id).avg_ratings)
+        self.assertEqual(adventures[0].avg_ratings['overall__avg'], 4)
+        self.assertEqual(adventures[1].avg_ratings['overall__avg'], None)
+
 
 class RoomTest(TestCase):
     def setUp(self):
@@ -48,3 +101,792 @@ class ViewTests(TestCase):
         self.assertContains(response, a1.description)
         self.assertNotContains(response, a2.name)
         self.assertNotContains(response, a2.description)
+
+
+class GameApiTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bundle(self):
+        response = self.client.get('/api/adventures/the-beginners-cave/bundle')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['adventure']['slug'], 'the-beginners-cave')
+        for key in ('rooms', 'artifacts', 'effects', 'monsters', 'hints'):
+            separate = self.client.get('/api/adventures/the-beginners-cave/' + key).json()
+            self.assertEqual(data[key], separate)
+        self.assertEqual(len(data['rooms']), 26)
+        self.assertEqual(len(data['rooms'][0]['exits']), 2)
+
+    def test_adventure_list(self):
+        for i in range(2, 10):
+            Adventure.objects.create(name="Adventure {}".format(i), slug="adventure-{}".format(i), active=True)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/adventures')
+        data = response.json()
+        self.assertEqual(len(data), 9)
+        self.assertEqual(data[-1]['slug'], 'the-beginners-cave')
+        self.assertEqual(data[-1]['authors'], ['Donald Brown'])
+        self.assertEqual(data[-1]['tags'], ['beginner', 'classic'])
+
+    def test_catalogue(self):
+        author = Author.objects.create(name="Tom Zuchowski")
+        for i in range(2, 5):
+            adventure = Adventure.objects.create(name="Adventure {}".format(i), slug="adventure-{}".format(i),
+                                                 description="A quest for the {}".format(['sword', 'ring'][i % 2]),
+                                                 featured_month='2021-0{}'.format(i), active=True)
+            adventure.authors.add(author)
+            adventure.tags.add('fantasy')
+        url = '/api/adventures/catalogue'
+        data = self.client.get(url).json()
+        self.assertEqual(data['count'], 4)
+        self.assertNotIn('intro_text', data['results'][0])
+        self.assertEqual(data['facets']['tags'][0], {'tag': 'fantasy', 'count': 3})
+        self.assertEqual(data['facets']['authors'][0], {'id': author.id, 'name': 'Tom Zuchowski', 'count': 3})
+
+        data = self.client.get(url, {'tag': ['fantasy'], 'q': 'RING quest'}).json()
+        self.assertEqual([a['slug'] for a in data['results']], ['adventure-3'])
+        self.assertEqual(data['facets']['featured_months'], [{'month': '2021-03', 'count': 1}])
+        data = self.client.get(url, {'author': author.id, 'featured_month': '2021-02'}).json()
+        self.assertEqual([a['slug'] for a in data['results']], ['adventure-2'])
+        self.assertEqual(self.client.get(url, {'author': 'Tom'}).status_code, 400)
+
+        # the index is rebuilt when the tags change
+        Adventure.objects.get(slug='the-beginners-cave').tags.add('fantasy')
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {'tag': 'fantasy'}).json()
+        self.assertEqual(data['count'], 4)
+        with self.assertNumQueries(1):
+            self.client.get(url, {'tag': 'fantasy'})
+
+    def test_streaming(self):
+        for name in ('artifacts', 'effects', 'monsters'):
+            url = '/api/adventures/the-beginners-cave/' + name
+            response = self.client.get(url, {'stream': 1})
+            self.assertTrue(response.streaming)
+            self.assertEqual(b''.join(response.streaming_content), self.client.get(url).content)
+            self.assertEqual(response['Last-Modified'], self.client.get(url)['Last-Modified'])
+
+        url = '/api/adventures/the-beginners-cave/effects'
+        response = self.client.get(url, {'stream': 1, 'fields': 'id,text'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         self.client.get(url, {'fields': 'id,text'}).json())
+        # not for other formats
+        response = self.client.get(url, {'stream': 1, 'format': 'columnar'})
+        self.assertFalse(response.streaming)
+
+    def test_fast_serializers(self):
+        Room.objects.filter(adventure_id=1, room_id=1).update(is_markdown=True, description='*here*')
+        for serializer_class, model, prefetch in SERIALIZERS:
+            queryset = model.objects.filter(adventure_id=1).order_by('pk')
+            for context in ({}, {'html': True}):
+                with self.subTest(serializer=serializer_class.__name__, context=context):
+                    expected = serializer_class(queryset.prefetch_related(*prefetch), many=True, context=context).data
+                    serializer = serializer_class(context=context)
+                    self.assertEqual(FastSerializer(serializer).serialize(queryset), expected)
+                    self.assertEqual(json.dumps(FastSerializer(serializer).serialize(queryset)), json.dumps(expected))
+        # leaves out the fields that were removed from the serializer
+        serializer = serializers.RoomSerializer()
+        serializer.fields.pop('description')
+        rooms = FastSerializer(serializer).serialize(Room.objects.filter(adventure_id=1))
+        self.assertNotIn('description', rooms[0])
+        self.assertEqual(len(rooms[0]['exits']), 2)
+
+        out = StringIO()
+        call_command('benchmark_serializers', 'the-beginners-cave', number=1, stdout=out)
+        self.assertIn('Effect', out.getvalue())
+
+    def test_effect_chains(self):
+        Effect.objects.filter(adventure_id=1, effect_id=1).update(next=2, next_inline=3)
+        Effect.objects.filter(adventure_id=1, effect_id=2).update(next=4)
+        Effect.objects.filter(adventure_id=1, effect_id=3).update(next_inline=99)
+        Room.objects.filter(adventure_id=1, room_id=1).update(effect=1, effect_inline=100)
+        data = self.client.get('/api/adventures/the-beginners-cave/effect-chains').json()
+        self.assertEqual(data['chains']['1'], [{'id': 1, 'inline': False}, {'id': 2, 'inline': False},
+                                               {'id': 4, 'inline': False}, {'id': 3, 'inline': True}])
+        self.assertEqual(data['dangling'], [{'type': 'effect', 'id': 3, 'field': 'next_inline', 'target': 99},
+                                            {'type': 'room', 'id': 1, 'field': 'effect_inline', 'target': 100}])
+        self.assertEqual(data['cycles'], [])
+
+        # a loop
+        Effect.objects.filter(adventure_id=1, effect_id=4).update(next=1)
+        data = self.client.get('/api/adventures/the-beginners-cave/effect-chains').json()
+        self.assertEqual(data['cycles'], [[1, 2, 4]])
+        self.assertEqual([e['id'] for e in data['chains']['4']], [4, 1, 2, 3])
+
+    def test_world_index(self):
+        Artifact.objects.filter(adventure_id=1, artifact_id=3).update(room_id=None, container_id=1)
+        Monster.objects.filter(adventure_id=1, monster_id=1).update(count=2, weapon_id=29)
+        data = self.client.get('/api/adventures/the-beginners-cave/world-index').json()
+        self.assertEqual(data['artifacts_by_room']['26'], [11, 15, 24])
+        self.assertNotIn('0', data['artifacts_by_room'])
+        self.assertEqual(data['contents'], {'1': [3]})
+        self.assertEqual(data['monsters_by_room']['18'], [2, 3])
+        # a group monster gets one weapon per member, starting from its weapon ID
+        self.assertEqual(data['weapons']['1'], [29, 30])
+        self.assertEqual(data['inventories']['1'], [29, 30])
+        self.assertEqual(data['inventories']['4'], [2])
+        self.assertNotIn('24', data['artifacts_by_room'])
+        self.assertEqual(data['doors'], {'14': [{'room_id': 15, 'direction': 'e'}]})
+
+        bundle = self.client.get('/api/adventures/the-beginners-cave/bundle').json()
+        self.assertEqual(bundle['indexes'], data)
+
+    def test_name_index(self):
+        url = '/api/adventures/the-beginners-cave/name-index'
+        data = self.client.get(url).json()
+        self.assertEqual(data['names']['strange potion'], [{'type': 'artifact', 'id': 3}])
+        self.assertEqual(data['names']['bottle'], [{'type': 'artifact', 'id': 3}])
+        self.assertEqual([e['id'] for e in data['ambiguous']['writing']], [28, 30])
+
+        monster = Monster.objects.get(adventure_id=1, monster_id=1)
+        monster.synonyms = ' Bottle,  Big   Guy'
+        monster.save()
+        data = self.client.get('/api/designer/adventures/the-beginners-cave/name-index').json()
+        self.assertEqual(data['names']['big guy'], [{'type': 'monster', 'id': 1}])
+        self.assertEqual(data['ambiguous']['bottle'], [{'type': 'artifact', 'id': 3}, {'type': 'monster', 'id': 1}])
+
+        # the two sides of a door
+        index = index_names([(1, 'door', None, None, 2), (2, 'Door', None, None, None)], [])
+        self.assertEqual(len(index['names']['door']), 2)
+        self.assertEqual(index['ambiguous'], {})
+
+    def test_columnar(self):
+        url = '/api/adventures/the-beginners-cave/rooms'
+        rooms = self.client.get(url).json()
+        response = self.client.get(url, HTTP_ACCEPT='application/vnd.eamon.columnar+json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.eamon.columnar+json')
+        data = json.loads(response.content)
+        self.assertEqual(data['columns'], list(rooms[0].keys()))
+        self.assertEqual(len(data['rows']), len(rooms))
+        exits = data['rows'][0][data['columns'].index('exits')]
+        self.assertEqual(exits['columns'], ['direction', 'room_to', 'door_id', 'effect_id'])
+        self.assertEqual(exits['rows'][0], list(rooms[0]['exits'][0].values()))
+
+        self.assertEqual(to_columns({'tags': ['a', 'b'], 'list': [], 'rows': [{'a': 1}, {'b': 2}]}),
+                         {'tags': ['a', 'b'], 'list': [], 'rows': {'columns': ['a', 'b'], 'rows': [[1, None], [None, 2]]}})
+
+    @skipUnless(has_msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        import msgpack
+        url = '/api/adventures/the-beginners-cave/monsters'
+        monsters = self.client.get(url).json()
+        response = self.client.get(url + '?format=msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), monsters)
+
+    def test_sparse_fieldsets(self):
+        url = '/api/adventures/the-beginners-cave/artifacts?fields=id,name,room_id'
+        with CaptureQueriesContext(connection) as context:
+            artifacts = self.client.get(url).json()
+        self.assertEqual(list(artifacts[0].keys()), ['id', 'name', 'room_id'])
+        self.assertNotIn('description', context.captured_queries[-1]['sql'])
+
+        monsters = self.client.get('/api/adventures/the-beginners-cave/monsters?exclude=description,data').json()
+        self.assertNotIn('description', monsters[0])
+        self.assertIn('hardiness', monsters[0])
+
+        # relations that aren't requested aren't prefetched
+        with self.assertNumQueries(2):
+            rooms = self.client.get('/api/adventures/the-beginners-cave/rooms?fields=id,name').json()
+        self.assertEqual(len(rooms), 26)
+        exits = self.client.get('/api/designer/adventures/the-beginners-cave/exits?fields=direction,room_to').json()
+        self.assertEqual(exits[0], {'direction': 'n', 'room_to': -999})
+
+        response = self.client.get('/api/adventures/the-beginners-cave/effects?fields=id,foo')
+        self.assertEqual(response.status_code, 400)
+
+    def test_neighborhood(self):
+        url = '/api/adventures/the-beginners-cave/rooms/{}/neighborhood'
+        data = self.client.get(url.format(1)).json()
+        self.assertEqual(data['distances'], {'1': 0, '2': 1})
+        self.assertEqual([r['id'] for r in data['rooms']], [1, 2])
+        self.assertEqual(data['monsters'], [])
+
+        # the whole cave is connected, so a big enough neighborhood has everything except the things that aren't
+        # in any room yet (e.g., dead bodies)
+        data = self.client.get(url.format(1), {'depth': 30}).json()
+        bundle = self.client.get('/api/adventures/the-beginners-cave/bundle').json()
+        self.assertEqual(sorted(r['id'] for r in data['rooms']), sorted(r['id'] for r in bundle['rooms']))
+        self.assertEqual(data['monsters'], [m for m in bundle['monsters'] if m['room_id']])
+        monster_ids = {m['id'] for m in data['monsters']}
+        self.assertEqual(data['artifacts'],
+                         [a for a in bundle['artifacts'] if a['room_id'] or a['monster_id'] in monster_ids])
+
+        # artifacts in containers
+        Artifact.objects.filter(adventure_id=1, artifact_id=1).update(room_id=2)
+        Artifact.objects.filter(adventure_id=1, artifact_id=2).update(room_id=None, container_id=1)
+        data = self.client.get(url.format(1)).json()
+        self.assertIn(2, [a['id'] for a in data['artifacts']])
+
+        self.assertEqual(self.client.get(url.format(999)).status_code, 404)
+        self.assertEqual(self.client.get(url.format(1), {'depth': 'x'}).status_code, 400)
+
+    def test_hints(self):
+        general_help = Hint.objects.create(question="EAMON GENERAL HELP.", edx="E001", index=1)
+        HintAnswer.objects.create(hint=general_help, index=1, answer="Type HELP for a list of commands.")
+        url = '/api/adventures/the-beginners-cave/hints'
+        hints = self.client.get(url).json()
+        self.assertEqual([h['question'][:5] for h in hints], ['EAMON', 'The B', 'The B'])
+        self.assertEqual(hints[0]['answers'][0]['answer'], "Type HELP for a list of commands.")
+
+        questions = self.client.get(url + '/questions').json()
+        self.assertEqual([q['question'] for q in questions], [h['question'] for h in hints])
+        self.assertNotIn('answers', questions[0])
+        for question, hint in zip(questions, hints):
+            answers = self.client.get('{}/{}/answers'.format(url, question['id'])).json()
+            self.assertEqual(answers, hint['answers'])
+            self.assertEqual(self.client.get('{}/{}'.format(url, question['id'])).json(), hint)
+
+        # another adventure's hints aren't available
+        other = Adventure.objects.create(name="Other", slug="other", active=True)
+        hint = Hint.objects.create(adventure=other, index=2, question="Where am I?")
+        response = self.client.get('{}/{}/answers'.format(url, hint.pk))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('{}/{}'.format(url, hint.pk)).status_code, 404)
+
+        # changes to the general help show up in every adventure
+        HintAnswer.objects.filter(hint=general_help).update(answer="Type HELP.")
+        for slug in ('the-beginners-cave', 'other'):
+            hints = self.client.get('/api/adventures/{}/hints'.format(slug)).json()
+            self.assertEqual(hints[0]['answers'][0]['answer'], "Type HELP.")
+
+    @skipUnless(has_markdown, "requires the markdown package")
+    def test_markdown_html(self):
+        Room.objects.filter(adventure_id=1, room_id=1).update(
+            is_markdown=True, description='You are *here*. <script>alert("hi")</script>')
+        url = '/api/adventures/the-beginners-cave/rooms'
+        rooms = self.client.get(url, {'html': 1}).json()
+        self.assertEqual(rooms[0]['description_html'], '<p>You are <em>here</em>. alert("hi")</p>')
+        self.assertNotIn('description_html', rooms[1])
+        self.assertNotIn('description_html', self.client.get(url).json()[0])
+        # only the requested fields
+        rooms = self.client.get(url, {'html': 1, 'fields': 'id,description'}).json()
+        self.assertEqual(set(rooms[0]), {'id', 'description', 'description_html'})
+
+        bundle = self.client.get('/api/adventures/the-beginners-cave/bundle', {'html': 1}).json()
+        self.assertEqual(bundle['rooms'][0]['description_html'], '<p>You are <em>here</em>. alert("hi")</p>')
+        self.assertIn('intro_text_html', bundle['adventure'])
+        self.assertIn('answer_html', bundle['hints'][0]['answers'][0])
+
+    def test_markdown_unavailable(self):
+        url = '/api/adventures/the-beginners-cave/rooms'
+        with mock.patch.object(serializers, 'has_markdown', False), mock.patch.object(rendering, 'has_markdown', False):
+            response = self.client.get(url, {'html': 1})
+            self.assertEqual(response['X-Markdown-HTML'], 'unavailable')
+            self.assertNotIn('description_html', response.json()[0])
+            self.assertNotIn('X-Markdown-HTML', self.client.get(url))
+
+    def test_bundle_inactive(self):
+        Adventure.objects.filter(slug='the-beginners-cave').update(active=False)
+        response = self.client.get('/api/adventures/the-beginners-cave/bundle')
+        self.assertEqual(response.status_code, 404)
+
+    def test_etag(self):
+        url = '/api/adventures/the-beginners-cave/rooms'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # changing the content changes the ETag
+        room = Room.objects.get(adventure_id=1, room_id=1)
+        room.name = 'in the new cave entrance'
+        room.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'in the new cave entrance')
+
+    def test_media_type_parameters(self):
+        # the cached payload is the same for every JSON client
+        url = '/api/adventures/the-beginners-cave/rooms'
+        indented = self.client.get(url, HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual(indented.content, self.client.get(url).content)
+        self.assertNotIn(b'\n', indented.content)
+
+    def test_last_modified(self):
+        # pretend the adventure was last edited yesterday
+        Adventure.objects.filter(slug='the-beginners-cave').update(content_updated_at=timezone.now() - timedelta(days=1))
+        url = '/api/adventures/the-beginners-cave/artifacts'
+        last_modified = self.client.get(url)['Last-Modified']
+        with self.assertNumQueries(1):
+            # only looks up the adventure
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Last-Modified'], last_modified)
+
+        # bulk updates don't send signals, but still update the adventure's timestamp
+        Artifact.objects.filter(adventure__slug='the-beginners-cave', artifact_id=1).update(name='dull sword')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+        self.assertEqual(response.json()[0]['name'], 'dull sword')
+
+    def test_gzip(self):
+        url = '/api/adventures/the-beginners-cave/effects'
+        plain = self.client.get(url)
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+
+
+class ContentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.version = timezone.now()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        time.sleep(0.1)
+        return 'build {}'.format(self.builds).encode()
+
+    def test_single_flight(self):
+        # several processes (here, threads) asking for the same missing payload only build it once
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            content_cache.get_payload(1, self.version, 'rooms:json', self.build))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual([r['content'] for r in results], [b'build 1'] * 5)
+
+    def test_failed_build(self):
+        # if the process building the payload fails, a waiting one builds it right away
+        building = threading.Event()
+        errors = []
+
+        def fail():
+            building.set()
+            time.sleep(0.1)
+            raise ValueError('build failed')
+
+        def first():
+            try:
+                content_cache.get_payload(1, self.version, 'rooms:json', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        building.wait()
+        start = time.monotonic()
+        payload = content_cache.get_payload(1, self.version, 'rooms:json', self.build)
+        thread.join()
+        self.assertEqual(payload['content'], b'build 1')
+        self.assertEqual(len(errors), 1)
+        self.assertLess(time.monotonic() - start, content_cache.LOCK_WAIT / 2)
+
+    def test_code_version(self):
+        # payloads built by the old code aren't used after a deployment
+        with override_settings(CONTENT_CACHE_VERSION='old'):
+            content_cache.get_payload(1, self.version, 'rooms:json', self.build)
+        with override_settings(CONTENT_CACHE_VERSION='new'):
+            self.assertEqual(content_cache.get_payload(1, self.version, 'rooms:json', self.build)['content'],
+                             b'build 2')
+
+    @override_settings(CONTENT_CACHE_SOFT_TIMEOUT=-1)
+    def test_soft_timeout(self):
+        with mock.patch.object(content_cache, 'run_in_background', lambda func: func()):
+            self.assertEqual(content_cache.get_payload(1, self.version, 'rooms:json', self.build)['content'],
+                             b'build 1')
+            # serves the old payload, and refreshes it
+            self.assertEqual(content_cache.get_payload(1, self.version, 'rooms:json', self.build)['content'],
+                             b'build 1')
+            self.assertEqual(self.builds, 2)
+            self.assertEqual(content_cache.get_payload(1, self.version, 'rooms:json', self.build)['content'],
+                             b'build 2')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                               'content': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'content'}},
+                       CONTENT_CACHE_ALIAS='content')
+    def test_cache_alias(self):
+        content_cache.get_payload(1, self.version, 'rooms:json', self.build)
+        key = content_cache.payload_key(1, self.version, 'rooms:json')
+        self.assertIsNotNone(caches['content'].get(key))
+        self.assertIsNone(caches['default'].get(key))
+
+
+class DesignerApiTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('designer', 'designer@example.com', 'x'))
+
+    def test_bulk(self):
+        url = '/api/designer/adventures/the-beginners-cave/rooms/bulk'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {
+                'create': [{'name': 'a new room', 'description': 'It looks new.'},
+                           {'id': 40, 'name': 'room 40', 'description': 'Empty.'}],
+                'update': [{'id': 1, 'name': 'at the cave entrance', 'effect': ''}, {'id': 2, 'is_dark': True}],
+                'delete': [26],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'created': [27, 40], 'updated': [1, 2], 'deleted': [26]})
+        self.assertLessEqual(len(context.captured_queries), get_query_budget(designer_views.RoomViewSet, 'bulk'))
+        rooms = {r.room_id: r for r in Room.objects.filter(adventure_id=1)}
+        self.assertEqual(rooms[27].description, 'It looks new.')
+        self.assertEqual((rooms[1].name, rooms[1].effect, rooms[2].is_dark), ('at the cave entrance', None, True))
+        self.assertNotIn(26, rooms)
+
+        # one bad item and nothing is saved
+        response = self.client.post(url, {
+            'create': [{'name': 'x' * 300}, {'id': 1, 'name': 'room 1 again'}],
+            'update': [{'id': 3, 'name': 'ok'}, {'id': 99}, {'id': 4, 'color': 'red'}],
+            'delete': [26],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertIn('name', errors['create'][0])
+        self.assertIn('id', errors['create'][1])
+        self.assertEqual(errors['update'][0], {})
+        self.assertEqual(errors['update'][1], {'id': ['Not found.']})
+        self.assertIn('non_field_errors', errors['update'][2])
+        self.assertEqual(errors['delete'], [{'id': ['Not found.']}])
+        self.assertNotEqual(Room.objects.get(adventure_id=1, room_id=3).name, 'ok')
+
+        # exits are in a room, by its in-game ID
+        url = '/api/designer/adventures/the-beginners-cave/exits/bulk'
+        response = self.client.post(url, {
+            'create': [{'room_from': 40, 'direction': 's', 'room_to': 1}, {'direction': 'n', 'room_to': 40}],
+        }, format='json')
+        self.assertEqual(response.json()['create'], [{}, {'room_from': ['This field is required.']}])
+        response = self.client.post(url, {'create': [{'room_from': 40, 'direction': 's', 'room_to': 1}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RoomExit.objects.get(room_from__room_id=40).adventure_id, 1)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(url, {'delete': []}, format='json').status_code, 401)
+
+    def test_replace_exits(self):
+        url = '/api/designer/adventures/the-beginners-cave/exits/replace'
+        exits = list(RoomExit.objects.filter(room_from__room_id=2).values_list('direction', 'room_to'))
+        self.assertEqual(sorted(exits), [('n', 1), ('s', 4)])
+        with self.assertNumQueries(get_query_budget(designer_views.RoomExitViewSet, 'replace')):
+            response = self.client.put(url + '?room=2', [
+                {'direction': 'n', 'room_to': 1},
+                {'direction': 's', 'room_to': 3, 'door_id': ''},
+                {'direction': 'e', 'room_to': 5},
+            ], format='json')
+        self.assertEqual(response.json(), {'created': 1, 'updated': 1, 'deleted': 0})
+        exits = list(RoomExit.objects.filter(room_from__room_id=2).values_list('direction', 'room_to', 'adventure_id'))
+        self.assertEqual(sorted(exits), [('e', 5, 1), ('n', 1, 1), ('s', 3, 1)])
+
+        response = self.client.put(url + '?room=2', [{'direction': 'n', 'room_to': 1}, {'direction': 'n'}],
+                                   format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[1], {'direction': ['The room already has an exit in this direction.']})
+
+        # the whole adventure, with the same exits except for room 2's
+        fields = ('room_from', 'direction', 'room_to', 'door_id', 'effect_id')
+        exits = [dict(zip(fields, row)) for row in RoomExit.objects.exclude(room_from__room_id=2)
+                 .values_list('room_from__room_id', *fields[1:])]
+        response = self.client.put(url, exits, format='json')
+        self.assertEqual(response.json(), {'created': 0, 'updated': 0, 'deleted': 3})
+        self.assertFalse(RoomExit.objects.filter(room_from__room_id=2).exists())
+
+        exit = RoomExit(room_from_id=Room.objects.get(adventure_id=1, room_id=2).pk, direction='u', room_to=1)
+        exit.save()
+        self.assertEqual(exit.adventure_id, 1)
+
+    def test_concurrency(self):
+        url = '/api/designer/adventures/the-beginners-cave/rooms/1'
+        self.assertEqual(self.client.get(url)['ETag'], '"1"')
+        response = self.client.patch(url, {'name': 'first'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(response.json()['version'], 2)
+
+        # somebody else's change
+        response = self.client.patch(url, {'name': 'second'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, 412)
+        self.assertEqual(Room.objects.get(adventure_id=1, room_id=1).name, 'first')
+        response = self.client.post('/api/designer/adventures/the-beginners-cave/rooms/bulk',
+                                    {'update': [{'id': 1, 'version': 1, 'name': 'second'}]}, format='json')
+        self.assertIn('version', response.json()['update'][0])
+
+        # without If-Match, or with the current version
+        self.assertEqual(self.client.patch(url, {'name': 'third'}, format='json').status_code, 200)
+        Room.objects.filter(adventure_id=1, room_id=1).update(is_dark=True)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"4"').status_code, 204)
+
+        # two processes saving the same row each get their own version
+        first, second = Room.objects.get(adventure_id=1, room_id=2), Room.objects.get(adventure_id=1, room_id=2)
+        first.save()
+        second.save()
+        self.assertEqual((first.version, second.version), (2, 3))
+
+    def test_changes(self):
+        url = '/api/designer/adventures/the-beginners-cave/changes'
+        # loading the fixture isn't logged
+        self.assertEqual(self.client.get(url).json(), {'cursor': 0})
+        self.client.patch('/api/designer/adventures/the-beginners-cave/rooms/1', {'name': 'new name'}, format='json')
+        self.client.delete('/api/designer/adventures/the-beginners-cave/artifacts/10')
+        self.client.post('/api/designer/adventures/the-beginners-cave/effects/bulk',
+                         {'create': [{'text': 'new effect'}]}, format='json')
+        Monster.objects.filter(adventure_id=1, monster_id__in=[1, 2]).update(friendliness='friend')
+        RoomExit.objects.bulk_create([RoomExit(adventure_id=1, room_from=Room.objects.get(adventure_id=1, room_id=2),
+                                               direction='u')])
+
+        # too new
+        self.assertEqual(self.client.get(url, {'since': 0}).json()['cursor'], 0)
+        ContentChange.objects.update(changed_at=timezone.now() - timedelta(minutes=1))
+        with CaptureQueriesContext(connection) as context:
+            data = self.client.get(url, {'since': 0}).json()
+        self.assertLessEqual(len(context.captured_queries),
+                             get_query_budget(designer_views.AdventureViewSet, 'changes'))
+        self.assertEqual(data['cursor'], ContentChange.objects.latest('id').id)
+        self.assertFalse(data['more'])
+        self.assertEqual([r['name'] for r in data['updated']['rooms']], ['new name'])
+        self.assertEqual(data['updated']['artifacts'], [])
+        self.assertEqual(data['deleted'], {'artifacts': [10]})
+        self.assertEqual([e['text'] for e in data['updated']['effects']], ['new effect'])
+        self.assertEqual(sorted(m['id'] for m in data['updated']['monsters']), [1, 2])
+        # SQLite doesn't return the new primary keys from bulk_create()
+        self.assertEqual(data['reload'], [] if connection.features.can_return_rows_from_bulk_insert else ['exits'])
+
+        self.assertEqual(self.client.get(url, {'since': data['cursor']}).json(),
+                         {'cursor': data['cursor'], 'more': False, 'updated': {}, 'deleted': {}, 'reload': []})
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+    def test_batch_changes(self):
+        # the settle time counts from when the batch is written
+        with batch_content_changes():
+            Room.objects.filter(adventure_id=1, room_id=1).update(name='new name')
+            before_flush = timezone.now()
+        self.assertGreaterEqual(ContentChange.objects.get().changed_at, before_flush)
+
+    def test_delete_adventure(self):
+        # the content deleted along with the adventure isn't logged
+        Room.objects.filter(adventure_id=1, room_id=1).update(name='new name')
+        with CaptureQueriesContext(connection) as context:
+            Adventure.objects.get(pk=1).delete()
+        # nor does it update the adventure being deleted
+        self.assertFalse([q for q in context.captured_queries if q['sql'].startswith('UPDATE "adventure_adventure"')])
+        self.assertFalse(ContentChange.objects.exists())
+        self.assertFalse(Room.objects.filter(adventure_id=1).exists())
+        connection.check_constraints()
+
+
+class IntegrityTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def test_check_objects(self):
+        def row(object_id, **fields):
+            return dict({'id': object_id, 'room_id': None, 'monster_id': None, 'container_id': None, 'guard_id': None,
+                         'key_id': None, 'linked_door_id': None, 'effect': None, 'effect_inline': None,
+                         'effect_id': None, 'num_effects': None, 'weapon_id': None, 'count': 1, 'next': None,
+                         'next_inline': None}, **fields)
+
+        findings = check_objects({
+            'room': [row(1), row(2), row(2)],
+            'exit': [dict(row(10), room_to=3, door_id=None), dict(row(11), room_to=-99, door_id=0)],
+            'artifact': [row(1, container_id=2), row(2, container_id=1), row(3, room_id=0, key_id=-1),
+                         row(4, effect_id=1, num_effects=3)],
+            'effect': [row(1, next=2), row(2, next_inline=1)],
+            'monster': [row(1, room_id=1, weapon_id=3, count=3)],
+        })
+        self.assertEqual(findings, [
+            {'problem': 'duplicate', 'type': 'room', 'id': 2},
+            {'problem': 'missing', 'type': 'exit', 'id': 10, 'field': 'room_to', 'target': 3},
+            {'problem': 'missing', 'type': 'artifact', 'id': 4, 'field': 'effect_id', 'target': 3},
+            {'problem': 'missing', 'type': 'monster', 'id': 1, 'field': 'weapon_id', 'target': 5},
+            {'problem': 'cycle', 'type': 'artifact', 'field': 'container_id', 'ids': [1, 2]},
+            {'problem': 'cycle', 'type': 'effect', 'field': 'next/next_inline', 'ids': [1, 2]},
+        ])
+
+    def test_check_adventure(self):
+        url = '/api/designer/adventures/the-beginners-cave/integrity'
+        self.assertEqual(self.client.get(url).json(), {'findings': []})
+        RoomExit.objects.filter(adventure_id=1, room_from__room_id=1, direction='n').update(room_to=99)
+        self.assertEqual(self.client.get(url).json()['findings'][0]['target'], 99)
+
+        out = StringIO()
+        call_command('check_integrity', workers=1, stdout=out)
+        self.assertIn('room_to points to 99, which does not exist', out.getvalue())
+        out = StringIO()
+        call_command('check_integrity', 'the-beginners-cave', workers=1, json=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['the-beginners-cave'][0]['field'], 'room_to')
+
+
+class WarmCachesTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def test_warm_caches(self):
+        cache.clear()
+        out = StringIO()
+        call_command('warm_caches', stdout=out)
+        self.assertIn("isn't shared", out.getvalue())
+        out = StringIO()
+        call_command('warm_caches', workers=1, formats=['json', 'columnar'], html=True, force=True, stdout=out)
+        self.assertRegex(out.getvalue(), r'the-beginners-cave: \d+ responses in')
+        for path in ('bundle', 'rooms', 'hints/questions', 'hints/2/answers'):
+            with self.assertNumQueries(1):
+                # only looks up the adventure
+                response = self.client.get('/api/adventures/the-beginners-cave/' + path)
+            self.assertEqual(response.status_code, 200)
+
+
+class StaticBundleTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as output, \
+                override_settings(STATIC_BUNDLES_DIR=output, STATIC_BUNDLES_URL='/static/bundles/'):
+            call_command('export_static_bundles', stdout=StringIO())
+            with open(os.path.join(output, 'manifest.json')) as f:
+                manifest = json.load(f)
+            filename = os.path.join(output, 'the-beginners-cave.{}.json'.format(
+                manifest['the-beginners-cave']['hash']))
+            with open(filename, 'rb') as f:
+                content = f.read()
+            with gzip.open(filename + '.gz', 'rb') as f:
+                self.assertEqual(f.read(), content)
+            self.assertEqual(content, self.client.get('/api/adventures/the-beginners-cave/bundle').content)
+            self.assertEqual(bundle_url('the-beginners-cave'), '/static/bundles/' + os.path.basename(filename))
+
+            # a new version replaces the old file
+            Room.objects.filter(adventure_id=1, room_id=1).update(name='at the cave entrance')
+            # the old file isn't used once the adventure has changed
+            self.assertIsNone(bundle_url('the-beginners-cave'))
+            call_command('export_static_bundles', 'the-beginners-cave', stdout=StringIO())
+            self.assertNotEqual(bundle_url('the-beginners-cave'), '/static/bundles/' + os.path.basename(filename))
+            self.assertFalse(os.path.exists(filename))
+
+
+@skipUnless(has_zstandard, "zstandard is not installed")
+class CompressionDictionaryTests(TestCase):
+    fixtures = [BEGINNERS_CAVE]
+
+    def test_dictionary(self):
+        url = '/api/adventures/the-beginners-cave/rooms'
+        with tempfile.TemporaryDirectory() as folder:
+            fixtures = os.path.join(folder, 'fixtures')
+            os.mkdir(fixtures)
+            shutil.copy(BEGINNERS_CAVE, fixtures)
+            path = os.path.join(folder, 'content.zdict')
+            out = StringIO()
+            call_command('train_dictionary', input=fixtures, output=path, size=4096, stdout=out)
+            self.assertIn('001-the-beginners-cave.json', out.getvalue())
+
+            # a file in the current directory
+            cwd = os.getcwd()
+            os.chdir(folder)
+            try:
+                call_command('train_dictionary', input=fixtures, output='bare.zdict', size=4096, stdout=StringIO())
+            finally:
+                os.chdir(cwd)
+            self.assertTrue(os.path.exists(os.path.join(folder, 'bare.zdict')))
+
+            cache.clear()
+            with override_settings(CONTENT_DICTIONARY_PATH=path):
+                response = self.client.get(url)
+                content = response.content
+                link = re.match(r'<(.+)>; rel="compression-dictionary"', response['Link']).group(1)
+                response = self.client.get(link)
+                self.assertEqual(response['Use-As-Dictionary'].split(',')[0], 'match="/api/adventures/*"')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.assertEqual(response.content, data)
+
+                sha256 = hashlib.sha256(data).digest()
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br, dcz',
+                                           HTTP_AVAILABLE_DICTIONARY=':{}:'.format(base64.b64encode(sha256).decode()))
+                self.assertEqual(response['Content-Encoding'], 'dcz')
+                self.assertEqual(response.content[8:40], sha256)
+                decompressor = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(data))
+                self.assertEqual(decompressor.decompress(response.content[40:]), content)
+
+                # a client with an old dictionary
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, dcz', HTTP_AVAILABLE_DICTIONARY=':abc=:')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertEqual(self.client.get(link[:-1] + '0').status_code, 404)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Calls every API route against a real adventure, and checks that it stays within the query budget declared on
+    its viewset with the @query_budget decorator. A route that suddenly needs more queries usually means a new N+1
+    query somewhere in the serializers.
+    """
+    fixtures = [BEGINNERS_CAVE]
+    slug = 'the-beginners-cave'
+
+    # extra routes to call, besides the list routes. (url, viewset action, HTTP method)
+    extra_routes = [
+        ('/api/adventures/the-beginners-cave', 'retrieve', 'get'),
+        ('/api/adventures/the-beginners-cave/bundle', 'bundle', 'get'),
+        ('/api/adventures/catalogue', 'catalogue', 'get'),
+        ('/api/adventures/the-beginners-cave/effect-chains', 'effect_chains', 'get'),
+        ('/api/adventures/the-beginners-cave/world-index', 'world_index', 'get'),
+        ('/api/adventures/the-beginners-cave/name-index', 'name_index', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/name-index', 'name_index', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/integrity', 'integrity', 'get'),
+        ('/api/adventures/the-beginners-cave/rooms/1/neighborhood', 'neighborhood', 'get'),
+        ('/api/adventures/the-beginners-cave/hints/questions', 'questions', 'get'),
+        ('/api/adventures/the-beginners-cave/hints/2', 'retrieve', 'get'),
+        ('/api/adventures/the-beginners-cave/hints/2/answers', 'answers', 'get'),
+        ('/api/profiles/ABCDEF', 'retrieve', 'get'),
+        ('/api/designer/adventures/the-beginners-cave', 'retrieve', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/rooms/1', 'retrieve', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/artifacts/1', 'retrieve', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/effects/1', 'retrieve', 'get'),
+        ('/api/designer/adventures/the-beginners-cave/monsters/1', 'retrieve', 'get'),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        PlayerProfile.objects.create(slug="ABCDEF", uuid="test-uuid")
+        player = Player.objects.create(name="Test Player", gender="m", uuid="test-uuid")
+        PlayerArtifact.objects.create(player=player, name="sword", type=2, weapon_type=5)
+        PlayerArtifact.objects.create(player=player, name="leather armor", type=11, armor_type=0)
+        SavedGame.objects.create(player=player, adventure_id=1, slot=1, data='{}')
+        SavedGame.objects.create(player=player, adventure_id=1, slot=2, data='{}')
+        Rating.objects.create(uuid="test-uuid", adventure_id=1, overall=5)
+        ActivityLog.objects.create(adventure_id=1, type='start adventure')
+
+    def get_routes(self):
+        """
+        Builds the list of routes to call, from the routers in adventure/urls.py
+        """
+        routes = []
+        for url_prefix, r in (('/api/', router), ('/api/designer/', designer_router)):
+            for prefix, viewset, basename in r.registry:
+                url = url_prefix + re.sub(r'\(\?P<adventure_id>[^)]*\)', self.slug, prefix).rstrip('$')
+                if hasattr(viewset, 'list'):
+                    # the player list is empty without a UUID
+                    routes.append((url + '?uuid=test-uuid', viewset, 'list', 'get'))
+                elif hasattr(viewset, 'create'):
+                    routes.append((url, viewset, 'create', 'post'))
+        for url, action, method in self.extra_routes:
+            routes.append((url, resolve(url).func.cls, action, method))
+        return routes
+
+    def test_query_budgets(self):
+        for url, viewset, action, method in self.get_routes():
+            with self.subTest(url=url, action=action):
+                budget = get_query_budget(viewset, action)
+                self.assertIsNotNone(budget, "{} has no @query_budget".format(viewset.__name__))
+                cache.clear()
+                data = {'type': 'start adventure', 'adventure': 1} if method == 'post' else None
+                with CaptureQueriesContext(connection) as context:
+                    response = getattr(self.client, method)(url, data)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    len(context.captured_queries), budget,
+                    "{} {} ran {} queries, over its budget of {}:\n{}".format(
+                        method.upper(), url, len(context.captured_queries), budget,
+                        "\n".join(q['sql'] for q in context.captured_queries)))
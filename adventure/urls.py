@@ -34,6 +34,8 @@ urlpatterns = [
     # REST API routes
     url(r'^api/', include(router.urls)),
     url(r'^api/designer/', include(designer_router.urls)),
+    url(r'^api/content-dictionary/(?P<dictionary_id>[0-9a-f]{64})$', views.content_dictionary,
+        name='content-dictionary'),
 
     # regular Django pages
     url(r'^$', views.index, name='index'),
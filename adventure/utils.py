@@ -0,0 +1,28 @@
+"""
+Helpers shared by the management commands
+"""
+import os
+
+from django.db import connections
+
+
+def write_file(filename, content):
+    """
+    Writes a file atomically, so the web server never sees a partially written file.
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(content)
+    os.replace(temp_filename, filename)
+
+
+def in_worker(func):
+    """
+    Wraps a function that runs in a worker thread, to close the thread's database connections when it's done
+    """
+    def run(*args):
+        try:
+            return func(*args)
+        finally:
+            connections.close_all()
+    return run
@@ -1,6 +1,10 @@
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.views.decorators.http import require_safe
 
+from .dictionary import DICTIONARY_MATCH, get_dictionary
 from .models import Adventure
+from .static_bundles import bundle_url
 
 
 def index(request, path=''):
@@ -31,11 +35,26 @@ def main_hall(request):
     return render(request, 'main-hall.html')
 
 
+@require_safe
+def content_dictionary(request, dictionary_id):
+    """
+    The shared dictionary for compressing the game data. See adventure/dictionary.py.
+    """
+    dictionary = get_dictionary()
+    if dictionary is None or dictionary.id != dictionary_id:
+        raise Http404()
+    response = HttpResponse(dictionary.data, content_type='application/octet-stream')
+    response['Use-As-Dictionary'] = 'match="{}", id="{}"'.format(DICTIONARY_MATCH, dictionary.id)
+    # the URL changes when the dictionary does
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 def adventure(request, slug):
     """
     The container for the "core" a.k.a. "adventure" angular app
     """
-    return render(request, 'adventure.html', {'slug': slug})
+    return render(request, 'adventure.html', {'slug': slug, 'bundle_url': bundle_url(slug)})
 
 
 def adventure_list(request):
@@ -0,0 +1,99 @@
+"""
+Indexes of where everything is at the start of an adventure.
+
+When a game starts, the client needs to know which artifacts are in each room, what's inside each container, what
+each monster is carrying, and which exits each door blocks. Finding those means scanning every artifact, monster and
+room exit, so the server builds the indexes once per content version and sends them with the game data.
+
+The indexes describe the adventure as it's stored in the database, before the game starts. Group monsters are indexed
+by the group's monster ID; the client splits them into individuals (and hands out their weapons) when it loads them.
+"""
+from adventure.models import Artifact, Monster, RoomExit
+
+
+def index_world(artifacts, monsters, exits):
+    """
+    Builds the initial-world indexes.
+
+    :param artifacts: (artifact ID, room ID, monster ID, container ID) for each artifact
+    :param monsters: (monster ID, room ID, container ID, weapon ID, count) for each monster
+    :param exits: (room ID, direction, door ID) for each room exit
+    :return: A dict with:
+        "artifacts_by_room": room ID => the IDs of the artifacts lying in the room. Room 0 is nowhere, so it's left
+          out, along with the monsters there.
+        "contents": container ID => the IDs of the artifacts inside it
+        "monsters_by_room": room ID => the IDs of the monsters in the room
+        "monsters_in_containers": container ID => the IDs of the monsters that come out when it's opened
+        "inventories": monster ID => the IDs of the artifacts it carries, including its weapon(s)
+        "weapons": monster ID => the IDs of the artifacts it starts out using as weapons. A group monster uses one
+          artifact per member, starting from its weapon ID.
+        "doors": door ID => the exits it blocks, as {"room_id": ..., "direction": ...}
+    """
+    monsters = sorted(monsters)
+    weapons = {}
+    for monster_id, room_id, container_id, weapon_id, count in monsters:
+        if weapon_id is not None and weapon_id > 0:
+            weapons[monster_id] = list(range(weapon_id, weapon_id + max(count or 1, 1)))
+    wielded_by = {artifact_id: monster_id for monster_id, ids in weapons.items() for artifact_id in ids}
+
+    artifacts_by_room = {}
+    contents = {}
+    inventories = {}
+    for artifact_id, room_id, monster_id, container_id in sorted(artifacts):
+        # the game moves weapons into their monster's inventory, wherever they are in the database
+        if artifact_id in wielded_by:
+            inventories.setdefault(wielded_by[artifact_id], []).append(artifact_id)
+        elif monster_id is not None:
+            inventories.setdefault(monster_id, []).append(artifact_id)
+        elif container_id is not None:
+            contents.setdefault(container_id, []).append(artifact_id)
+        elif room_id:
+            artifacts_by_room.setdefault(room_id, []).append(artifact_id)
+
+    monsters_by_room = {}
+    monsters_in_containers = {}
+    for monster_id, room_id, container_id, weapon_id, count in monsters:
+        if container_id is not None:
+            monsters_in_containers.setdefault(container_id, []).append(monster_id)
+        elif room_id:
+            monsters_by_room.setdefault(room_id, []).append(monster_id)
+
+    doors = {}
+    for room_id, direction, door_id in sorted(exits, key=lambda e: (e[0], e[1])):
+        if door_id:
+            doors.setdefault(door_id, []).append({'room_id': room_id, 'direction': direction})
+
+    return {
+        'artifacts_by_room': artifacts_by_room,
+        'contents': contents,
+        'monsters_by_room': monsters_by_room,
+        'monsters_in_containers': monsters_in_containers,
+        'inventories': inventories,
+        'weapons': weapons,
+        'doors': doors,
+    }
+
+
+def index_game_data(rooms, artifacts, monsters):
+    """
+    Builds the initial-world indexes from the serialized game data (e.g., in the bundle), without querying it again.
+    """
+    return index_world(
+        ((a['id'], a['room_id'], a['monster_id'], a['container_id']) for a in artifacts),
+        ((m['id'], m['room_id'], m['container_id'], m['weapon_id'], m['count']) for m in monsters),
+        ((r['id'], e['direction'], e['door_id']) for r in rooms for e in r['exits']),
+    )
+
+
+def build_world_index(adventure_id):
+    """
+    Builds the initial-world indexes of an adventure. See index_world().
+    """
+    return index_world(
+        Artifact.objects.filter(adventure_id=adventure_id)
+        .values_list('artifact_id', 'room_id', 'monster_id', 'container_id'),
+        Monster.objects.filter(adventure_id=adventure_id)
+        .values_list('monster_id', 'room_id', 'container_id', 'weapon_id', 'count'),
+        RoomExit.objects.filter(room_from__adventure_id=adventure_id)
+        .values_list('room_from__room_id', 'direction', 'door_id'),
+    )
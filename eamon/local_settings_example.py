@@ -16,3 +16,16 @@ DATABASES = {
         }
     }
 }
+
+# Uncomment the following to share the cached game data between processes using Redis.
+# Needs Django 4.0+ or the django-redis package. Memcached or the file-based cache also work.
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+#     },
+#     'content': {
+#         'BACKEND': 'django_redis.cache.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379/1',
+#     }
+# }
+# CONTENT_CACHE_ALIAS = 'content'
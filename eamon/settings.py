@@ -149,6 +149,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
+# Static copies of the adventure data, written by the export_static_bundles management command
+STATIC_BUNDLES_DIR = os.path.join(STATIC_ROOT, 'bundles')
+STATIC_BUNDLES_URL = STATIC_URL + 'bundles/'
+
+# The cache for the game data served by the API. Can be any cache in CACHES. With several processes, use a cache
+# they share, e.g., Redis or Memcached. See adventure/content_cache.py.
+CONTENT_CACHE_ALIAS = 'default'
+# Part of the keys of the cached game data, so a deployment doesn't serve data built by the old code. None means
+# the git revision.
+CONTENT_CACHE_VERSION = None
+# How many seconds until the cached game data is rebuilt in the background, to update the play counts and ratings
+CONTENT_CACHE_SOFT_TIMEOUT = 60 * 10
+# The shared zstd dictionary for compressing the game data, written by the train_dictionary management command. See
+# adventure/dictionary.py.
+CONTENT_DICTIONARY_PATH = os.path.join(STATIC_ROOT, 'dictionaries', 'content.zdict')
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
@@ -104,6 +104,17 @@ def _db_backup():
     c.run('mysqldump eamon -u eamon -p{} | gzip > {}/db/{}.gz'.format(pw, server_root, fn))
 
 
+def _train_dictionary():
+    print('-- training the compression dictionary...')
+    c.run('{} {}/manage.py train_dictionary'.format(server_python, server_root))
+
+
+def _warm_caches():
+    print('-- warming up the adventure caches...')
+    # does nothing unless the server has a shared content cache (see CONTENT_CACHE_ALIAS)
+    c.run('{} {}/manage.py warm_caches'.format(server_python, server_root))
+
+
 # tasks
 @task
 def disk_space(context):
@@ -147,6 +158,22 @@ def migrate(context):
     _db_migrate()
 
 
+@task
+def warm_caches(context):
+    """builds the cached game data for all adventures on the server"""
+    _warm_caches()
+
+
+@task
+def train_dictionary(context):
+    """trains the compression dictionary on the server
+
+    Clients have to download the dictionary again each time it changes,
+    so only run this when the adventures have changed a lot.
+    """
+    _train_dictionary()
+
+
 @task
 def build_js(context):
     """builds js and css for production deploy"""
@@ -189,6 +216,7 @@ def deploy_js(context):
     c.put('client/build/static/css/style.css', remote='{}/css/'.format(remote_static))
     print('-- collecting static...')
     c.run('{} {}/manage.py collectstatic --no-input'.format(server_python, server_root))
+    _warm_caches()
     print('-- restarting server...')
     c.run('sudo apachectl graceful')
     print('-- Done!')
@@ -5,10 +5,12 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from adventure.api.budget import query_budget
 from .models import Player, PlayerProfile, Rating, SavedGame, ActivityLog, generate_slug
 from . import serializers
 
 
+@query_budget(1)
 class SavedGameViewSet(viewsets.ModelViewSet):
     """
     API endpoints for saved games. This is read/write.
@@ -22,7 +24,7 @@ class SavedGameViewSet(viewsets.ModelViewSet):
         Optionally restricts the returned purchases to a given user,
         by filtering against a `username` query parameter in the URL.
         """
-        queryset = SavedGame.objects.all()
+        queryset = SavedGame.objects.select_related('adventure')
         player_id = self.request.query_params.get('player_id', None)
         if player_id is not None:
             queryset = queryset.filter(player_id=player_id)
@@ -70,6 +72,7 @@ class SavedGameViewSet(viewsets.ModelViewSet):
         return super(SavedGameViewSet, self).destroy(instance)
 
 
+@query_budget(1)
 class PlayerProfileViewSet(viewsets.ModelViewSet):
     """
     API endpoints for user data. This is read/write.
@@ -160,11 +163,12 @@ class PlayerProfileViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_404_NOT_FOUND)
 
 
+@query_budget(4)
 class PlayerViewSet(viewsets.ModelViewSet):
     """
     API endpoints for player data. This is read/write.
     """
-    queryset = Player.objects.all()
+    queryset = Player.objects.prefetch_related('inventory', 'saved_games__adventure')
     serializer_class = serializers.PlayerSerializer
     permission_classes = (AllowAny,)
 
@@ -222,9 +226,15 @@ class PlayerViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(instance, data=request.data, partial=False)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
+
+        if getattr(instance, '_prefetched_objects_cache', None):
+            # The inventory was replaced, so the prefetched copy is out of date.
+            instance._prefetched_objects_cache = {}
+
         return Response(serializer.data)
 
 
+@query_budget(2)
 class LogViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     """
     API endpoints for the logger. This is read/write.
@@ -234,6 +244,7 @@ class LogViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     permission_classes = (AllowAny,)
 
 
+@query_budget(1)
 class RatingViewSet(viewsets.ModelViewSet):
     """
     API endpoints for ratings. This is read/write.